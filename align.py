@@ -0,0 +1,74 @@
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from filter_comment import filter_space_and_comment
+
+
+def _longest_increasing(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """pairs 已按第一个元素递增排列，取第二个元素严格递增的最长子序列（O(k log k)）"""
+    tails: List[int] = []  # tails[l] 为长度 l+1 的子序列结尾元素在 pairs 中的下标
+    tail_values: List[int] = []
+    previous = [-1] * len(pairs)
+    for i, (_, value) in enumerate(pairs):
+        l = bisect_left(tail_values, value)
+        if l > 0:
+            previous[i] = tails[l-1]
+        if l == len(tails):
+            tails.append(i)
+            tail_values.append(value)
+        else:
+            tails[l] = i
+            tail_values[l] = value
+    result = []
+    i = tails[-1] if tails else -1
+    while i != -1:
+        result.append(pairs[i])
+        i = previous[i]
+    result.reverse()
+    return result
+
+
+def align_lines(source_lines: List[str], generated_lines: List[str], code_type: str) -> List[Optional[int]]:
+    """
+    把源码行按顺序对应到生成的（带注释的）行上
+
+    每行只规范化（去掉空白和注释）一次。先用两边都只出现一次的行作锚点（取保持顺序的最长子序列，
+    即 patience diff），再在相邻锚点之间按顺序匹配其余行，匹配位置单调递增，
+    重复行（如 "}"）不会回头匹配到前面的注释，一行缺失也只影响它所在的锚点区间
+
+    返回:
+        与 source_lines 等长的列表，元素为对应的生成行下标；空行或未找到对应行时为 None
+    """
+    source_keys = [filter_space_and_comment(line, code_type) if line.strip() != "" else "" for line in source_lines]
+    generated_keys = [filter_space_and_comment(line, code_type) for line in generated_lines]
+
+    positions: Dict[str, List[int]] = {}
+    for j, key in enumerate(generated_keys):
+        if key:
+            positions.setdefault(key, []).append(j)
+    source_count: Dict[str, int] = {}
+    for key in source_keys:
+        if key:
+            source_count[key] = source_count.get(key, 0) + 1
+
+    # 锚点：两边都只出现一次的行
+    unique_pairs = [(i, positions[key][0]) for i, key in enumerate(source_keys)
+                    if key and source_count[key] == 1 and len(positions.get(key, ())) == 1]
+    anchors = _longest_increasing(unique_pairs)
+    anchors.append((len(source_lines), len(generated_lines)))
+
+    result: List[Optional[int]] = [None] * len(source_lines)
+    start, cursor = 0, 0
+    for anchor_source, anchor_generated in anchors:
+        # 在 [cursor, anchor_generated) 区间内按顺序匹配 [start, anchor_source) 的源码行
+        for i in range(start, anchor_source):
+            candidates = positions.get(source_keys[i]) if source_keys[i] else None
+            if not candidates:
+                continue
+            j = bisect_left(candidates, cursor)
+            if j < len(candidates) and candidates[j] < anchor_generated:
+                result[i] = candidates[j]
+                cursor = candidates[j] + 1
+        if anchor_source < len(source_lines):
+            result[anchor_source] = anchor_generated
+        start, cursor = anchor_source + 1, anchor_generated + 1
+    return result
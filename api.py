@@ -1,12 +1,262 @@
 import http.client
 import json
+import socket
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
-from typing import Dict, Optional, Any
+from typing import AsyncIterator, Callable, Dict, Optional, Any, Tuple
 from config import Config  # 假设前面的Config类定义在config.py中
+from rate_limiter import AdaptiveRateLimiter, parse_retry_after
+from tokenizer import estimate_tokens
+from metrics import metrics
 import asyncio
 
-async def call_llm_api(config: Config, prompt: str, system_prompt: Optional[str] = None, 
-                temperature: float = 0.7, extra_params: Optional[Dict] = None) -> Dict:
+
+class ConnectionPool:
+    """
+    单个 host 的 keep-alive 连接池
+
+    http.client 本身是阻塞的，这里把每次请求放到专属线程池中执行，
+    协程只 await 结果，不会阻塞事件循环；请求结束后连接放回池中复用，避免每次都重新握手
+    """
+
+    def __init__(self, scheme: str, netloc: str, size: int, timeout: float = 60):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = deque()  # 空闲连接
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix=f"http-{netloc}")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def _acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """取出一个空闲连接，没有则新建；第二个返回值表示是否为复用的连接"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(), False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _open_response(self, method: str, path: str, body: bytes, headers: Dict[str, str]) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """发送请求并取得响应头，复用的连接若已被服务端关闭则换新连接重试一次"""
+        conn, reused = self._acquire()
+        while True:
+            try:
+                conn.request(method=method, url=path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    http.client.BadStatusLine, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                # keep-alive 连接已失效，换一个新连接重试
+                conn, reused = self._new_connection(), False
+            except Exception:
+                conn.close()
+                raise
+
+    def _finish(self, conn: http.client.HTTPConnection, response: http.client.HTTPResponse) -> None:
+        """响应读完后归还连接（服务端要求关闭时直接关闭）"""
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+
+    def _request_sync(self, method: str, path: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        """在工作线程中执行的阻塞请求"""
+        conn, response = self._open_response(method, path, body, headers)
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        self._finish(conn, response)
+        return response.status, {k.lower(): v for k, v in response.getheaders()}, data
+
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 信号量与事件循环绑定，换了事件循环就重新创建
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.size)
+        return loop
+
+    async def request(self, method: str, path: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        """异步发送请求，同一时刻最多 size 个请求在途"""
+        loop = self._bind_loop()
+        async with self._semaphore:
+            return await loop.run_in_executor(self._executor, self._request_sync, method, path, body, headers)
+
+    async def stream(self, method: str, path: str, body: bytes, headers: Dict[str, str]) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        异步发送请求并逐行读取响应（用于 SSE 流式输出）
+
+        依次产出 ("status", (状态码, 响应头))，然后是若干 ("line", bytes)；
+        状态码 >= 400 时改为产出一次 ("body", bytes)
+        调用方提前结束迭代时关闭连接以中止读取，该连接不再复用
+        """
+        loop = self._bind_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+        holder = {}
+
+        def put(item: Tuple[str, Any]) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        def worker() -> None:
+            try:
+                conn, response = self._open_response(method, path, body, headers)
+                holder["conn"] = conn
+                put(("status", (response.status, {k.lower(): v for k, v in response.getheaders()})))
+                if response.status >= 400:
+                    put(("body", response.read()))
+                else:
+                    while not cancelled.is_set():
+                        line = response.readline()
+                        if not line:
+                            break
+                        put(("line", line))
+                if cancelled.is_set():
+                    conn.close()
+                else:
+                    self._finish(conn, response)
+                put(("end", None))
+            except Exception as e:
+                if "conn" in holder:
+                    holder["conn"].close()
+                put(("error", e))
+
+        async with self._semaphore:
+            future = loop.run_in_executor(self._executor, worker)
+            try:
+                while True:
+                    kind, value = await queue.get()
+                    if kind == "error":
+                        if cancelled.is_set():
+                            break
+                        raise value
+                    if kind == "end":
+                        break
+                    yield kind, value
+            finally:
+                if not future.done():
+                    cancelled.set()
+                    # 关闭底层 socket，打断工作线程中阻塞的 readline
+                    conn = holder.get("conn")
+                    if conn is not None and conn.sock is not None:
+                        try:
+                            conn.sock.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+                await asyncio.wait([future])
+
+    def close(self) -> None:
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+        self._executor.shutdown(wait=False)
+
+
+_pools: Dict[Tuple[str, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(scheme: str, netloc: str, size: int) -> ConnectionPool:
+    """按 (scheme, host) 获取共享连接池，不存在则创建"""
+    key = (scheme, netloc)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(scheme, netloc, size)
+            _pools[key] = pool
+        return pool
+
+
+def close_connection_pools() -> None:
+    """关闭所有连接池（程序结束时调用）"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+async def _stream_completion(pool: ConnectionPool, path: str, body: bytes, headers: Dict[str, str],
+                             on_delta: Optional[Callable[[str], Optional[str]]]) -> Tuple[int, Dict[str, str], bytes, Optional[Dict]]:
+    """
+    读取 SSE 流式响应，把增量内容拼成与非流式一致的响应字典
+    on_delta 每收到一段增量调用一次，返回非空字符串（中止原因）时立即断开连接
+
+    返回: (状态码, 响应头, 错误响应体, 拼好的响应字典；出错时为 None)
+    """
+    status_code, response_headers, error_body = 0, {}, b""
+    content_parts = []
+    usage = None
+    finish_reason = None
+    abort_reason = None
+    events = pool.stream("POST", path, body, headers)
+    try:
+        async for kind, value in events:
+            if kind == "status":
+                status_code, response_headers = value
+                continue
+            if kind == "body":
+                error_body = value
+                continue
+            line = value.decode("utf-8", errors="replace").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                event = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            if event.get("usage"):
+                usage = event["usage"]
+            choices = event.get("choices") or [{}]
+            finish_reason = choices[0].get("finish_reason") or finish_reason
+            delta = (choices[0].get("delta") or {}).get("content") or ""
+            if delta:
+                content_parts.append(delta)
+                if on_delta is not None:
+                    abort_reason = on_delta(delta)
+                    if abort_reason:
+                        break
+    finally:
+        await events.aclose()
+    if status_code >= 400:
+        return status_code, response_headers, error_body, None
+    return status_code, response_headers, b"", {
+        "choices": [{"message": {"content": "".join(content_parts)}, "finish_reason": finish_reason}],
+        "usage": usage,
+        "abort_reason": abort_reason
+    }
+
+
+def estimate_request_tokens(config: Config, prompt: str, system_prompt: Optional[str] = None) -> int:
+    """粗略估算一次请求占用的token数（输入按字符估算，输出按 max_tokens 上限计）"""
+    return estimate_tokens(prompt + (system_prompt or "")) + config.max_tokens
+
+
+async def _call_llm_api(config: Config, prompt: str, system_prompt: Optional[str] = None, 
+                temperature: float = 0.7, extra_params: Optional[Dict] = None,
+                limiter: Optional[AdaptiveRateLimiter] = None, stream: bool = False,
+                on_delta: Optional[Callable[[str], Optional[str]]] = None) -> Dict:
     """
     调用大模型API的通用函数（基于Config配置）
     
@@ -16,9 +266,14 @@ async def call_llm_api(config: Config, prompt: str, system_prompt: Optional[str]
         system_prompt: 系统提示词（可选，用于设定模型行为）
         temperature: 生成温度（0-1，控制随机性）
         extra_params: 额外的API参数（如top_p、frequency_penalty等）
+        limiter: 共享的限流器（可选），发送前等待额度，并根据429/成功响应调整速率
+        stream: 是否使用 SSE 流式输出
+        on_delta: 流式模式下每收到一段增量内容时的回调，返回非空字符串（中止原因）则立即中止
     
     返回:
         解析后的API响应字典（包含生成结果或错误信息）
+        可重试的错误（429、5xx、网络错误）带有 "retryable": True，服务端给出的等待时间放在 "retry_after"
+        流式输出被 on_delta 中止时返回错误，"abort_reason" 为中止原因，"generated_content" 为已收到的内容
     """
     # 1. 基础参数校验
     if not config.api_key:
@@ -49,6 +304,8 @@ async def call_llm_api(config: Config, prompt: str, system_prompt: Optional[str]
         "role": "user",
         "content": prompt.strip()
     })
+    if stream:
+        request_data["stream"] = True
     # 合并额外参数（覆盖默认值）
     if extra_params and isinstance(extra_params, dict):
         request_data.update(extra_params)
@@ -59,44 +316,63 @@ async def call_llm_api(config: Config, prompt: str, system_prompt: Optional[str]
     }
     # 5. 发送API请求
     try:
-        # 根据协议创建连接（http/https）
-        if parsed_url.scheme == "https":
-            conn = http.client.HTTPSConnection(parsed_url.netloc, timeout=60)
-        else:
-            conn = http.client.HTTPConnection(parsed_url.netloc, timeout=60)
+        # 按 host 复用连接池中的 keep-alive 连接（http/https）
+        pool = get_connection_pool(parsed_url.scheme, parsed_url.netloc, config.pool_size)
         # 拼接请求路径（包含URL中的路径和查询参数）
         request_path = parsed_url.path or "/"
         if parsed_url.query:
             request_path += f"?{parsed_url.query}"
-        # 发送POST请求
-        conn.request(
-            method="POST",
-            url=request_path,
-            body=json.dumps(request_data).encode("utf-8"),
-            headers=headers
-        )
-        # 获取响应
-        response = conn.getresponse()
-        status_code = response.status
-        response_body = response.read().decode("utf-8")
-        conn.close()
+        # 等待限流器放行
+        estimated_tokens = estimate_request_tokens(config, prompt, system_prompt)
+        if limiter is not None:
+            with metrics.span("rate_limit_wait"):
+                await limiter.acquire(estimated_tokens)
+        # 发送POST请求并获取响应
+        body = json.dumps(request_data).encode("utf-8")
+        if stream:
+            status_code, response_headers, response_body, streamed_json = await _stream_completion(
+                pool, request_path, body, headers, on_delta
+            )
+        else:
+            status_code, response_headers, response_body = await pool.request("POST", request_path, body, headers)
+            streamed_json = None
+        response_body = response_body.decode("utf-8")
+        retryable = status_code == 429 or status_code >= 500
+        retry_after = parse_retry_after(response_headers.get("retry-after"))
+        if status_code == 429 and limiter is not None:
+            limiter.on_throttled(retry_after)
         # 解析JSON响应
         try:
-            response_json = json.loads(response_body)
+            response_json = streamed_json if streamed_json is not None else json.loads(response_body)
         except json.JSONDecodeError:
             return {
                 "error": "API返回非JSON格式数据",
                 "status_code": status_code,
-                "raw_response": response_body
+                "raw_response": response_body,
+                "retryable": retryable,
+                "retry_after": retry_after
             }
         # 处理HTTP错误状态码
         if status_code >= 400:
-            error_msg = response_json.get("error", {}).get("message", "未知错误")
+            error = response_json.get("error", {})
+            error_msg = error.get("message", "未知错误") if isinstance(error, dict) else str(error)
             return {
                 "error": f"API请求失败（状态码：{status_code}）",
                 "detail": error_msg,
                 "status_code": status_code,
-                "response": response_json
+                "response": response_json,
+                "retryable": retryable,
+                "retry_after": retry_after
+            }
+        if limiter is not None:
+            usage = response_json.get("usage") or {}
+            limiter.on_success(estimated_tokens, usage.get("total_tokens"))
+        if response_json.get("abort_reason"):
+            return {
+                "error": f"流式输出已提前中止：{response_json['abort_reason']}",
+                "status_code": status_code,
+                "abort_reason": response_json["abort_reason"],
+                "generated_content": response_json["choices"][0]["message"]["content"]
             }
         # with open("response.json", "w", encoding="utf-8") as f:
         #     f.write(json.dumps(response_json, indent=4))
@@ -114,13 +390,35 @@ async def call_llm_api(config: Config, prompt: str, system_prompt: Optional[str]
             "generated_content": response_json.get("choices", [{}])[0].get("message", {}).get("content")
         }
     except http.client.HTTPException as e:
-        return {"error": f"HTTP连接错误：{str(e)}"}
+        return {"error": f"HTTP连接错误：{str(e)}", "retryable": True}
     except TimeoutError:
-        return {"error": "API请求超时（超过60秒）"}
+        return {"error": "API请求超时（超过60秒）", "retryable": True}
+    except OSError as e:
+        return {"error": f"网络连接错误：{str(e)}", "retryable": True}
     except Exception as e:
         return {"error": f"请求过程出错：{str(e)}"}
 
 
+async def call_llm_api(config: Config, prompt: str, system_prompt: Optional[str] = None,
+                temperature: float = 0.7, extra_params: Optional[Dict] = None,
+                limiter: Optional[AdaptiveRateLimiter] = None, stream: bool = False,
+                on_delta: Optional[Callable[[str], Optional[str]]] = None) -> Dict:
+    """调用大模型API（参数和返回值见 _call_llm_api），并记录耗时、结果和token用量指标"""
+    with metrics.span("call_llm_api"):
+        result = await _call_llm_api(config, prompt, system_prompt, temperature, extra_params, limiter, stream, on_delta)
+    if result.get("success"):
+        outcome = "success"
+    elif result.get("abort_reason"):
+        outcome = "aborted"
+    else:
+        outcome = "retryable_error" if result.get("retryable") else "error"
+    metrics.inc("api_calls_total", labels={"outcome": outcome, "status": result.get("status_code", 0)})
+    usage = (result.get("response") or {}).get("usage") or {}
+    metrics.inc("api_prompt_tokens_total", usage.get("prompt_tokens") or 0)
+    metrics.inc("api_completion_tokens_total", usage.get("completion_tokens") or 0)
+    return result
+
+
 # 使用示例
 # if __name__ == "__main__":
 #     try:
@@ -0,0 +1,149 @@
+import asyncio
+import re
+from typing import Dict, List, Optional, Set
+from api import call_llm_api
+from init_project import AppContext
+from file_process import FileProcess, SYSTEM_PROMPT
+from extract_comment import extract_code_blocks
+from rate_limiter import backoff_delay
+from scheduler import ChunkScheduler
+from metrics import metrics
+
+BATCH_PROMPT_TEMPLATE = "以下是{count}个互不相关的代码片段，每个片段放在以 ```语言 id=编号 开头的代码块中：\n{blocks}\n请分别给出每个片段逐行详细注释后的代码，只给出带有注释的代码即可，不要修改或删除代码片段的任何内容（因为是代码片段，所以可能有多余的括号，请不要删除多余的括号，也不要补充缺少的括号，确保删除注释后和源代码每行都相同），输出格式：每个片段一个代码块，代码块开头保留原来的 ```语言 id=编号 标记，按编号顺序输出。"
+BATCH_BLOCK_TEMPLATE = "片段{id}，路径:{file_path}：\n```{lang} id={id}\n{content}\n```\n"
+
+_ID_RE = re.compile(r"\bid\s*=\s*(\d+)")
+
+
+class BatchMember:
+    def __init__(self, file_process: FileProcess, tokens: int, future: "asyncio.Future[bool]"):
+        self.file_process = file_process
+        self.tokens = tokens
+        self.future = future
+
+
+def build_batch_prompt(members: List[BatchMember]) -> str:
+    blocks = "".join(BATCH_BLOCK_TEMPLATE.format(id=i + 1, file_path=member.file_process.file_path,
+                                                 lang=member.file_process.code_type.lstrip("."),
+                                                 content=member.file_process.content.rstrip("\n"))
+                     for i, member in enumerate(members))
+    return BATCH_PROMPT_TEMPLATE.format(count=len(members), blocks=blocks)
+
+
+def split_batch_reply(text: str) -> Dict[int, str]:
+    """按代码块标识中的 id=编号 拆分批量请求的输出，同一编号出现多次时视为无效"""
+    blocks: Dict[int, Optional[str]] = {}
+    for info, content in extract_code_blocks(text, with_lang=True):
+        match = _ID_RE.search(info)
+        if match is None:
+            continue
+        block_id = int(match.group(1))
+        blocks[block_id] = None if block_id in blocks else content
+    return {block_id: content for block_id, content in blocks.items() if content is not None}
+
+
+class ChunkBatcher:
+    """
+    把多个小分块（可能来自不同文件）合并为一个请求
+
+    小分块先进入等待队列，凑满 max_chunks 个、总token超出 max_tokens 或等待 wait 秒后发出一个批量请求；
+    等待期间不占用调度器的并发名额，批量请求本身占用一个名额。输出按代码块的 id 拆分后逐个分块校验，
+    没有得到可用结果的分块由调用方单独重试
+    """
+
+    def __init__(self, ctx: AppContext, scheduler: ChunkScheduler, max_chunks: int, max_tokens: int, chunk_tokens: int, wait: float):
+        self.ctx = ctx
+        self.scheduler = scheduler
+        self.max_chunks = max_chunks
+        self.max_tokens = max_tokens
+        self.chunk_tokens = chunk_tokens
+        self.wait = wait
+        self._pending: List[BatchMember] = []
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0  # 发出的批量请求数
+        self.batched_chunks = 0  # 批量请求中得到可用结果的分块数
+        self.fallbacks = 0  # 批量请求中没有得到可用结果、转为单独请求的分块数
+
+    def accepts(self, file_process: FileProcess) -> bool:
+        return self.ctx.token_counter(file_process.content) <= self.chunk_tokens
+
+    async def generate(self, file_process: FileProcess) -> bool:
+        """加入等待队列，返回批量请求是否给出了该分块的可用结果（结果已写入 file_process）"""
+        tokens = self.ctx.token_counter(file_process.content)
+        if self._pending and self._pending_tokens + tokens > self.max_tokens:
+            self._flush()
+        loop = asyncio.get_running_loop()
+        member = BatchMember(file_process, tokens, loop.create_future())
+        self._pending.append(member)
+        self._pending_tokens += tokens
+        if len(self._pending) >= self.max_chunks:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.wait, self._flush)
+        async with self.scheduler.released():
+            return await member.future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        members, self._pending, self._pending_tokens = self._pending, [], 0
+        if len(members) == 1:
+            # 只有一个分块时合并没有意义，直接单独请求（还能使用流式校验等单分块的处理）
+            members[0].future.set_result(False)
+        elif members:
+            task = asyncio.ensure_future(self.scheduler.run(lambda: self._run_batch(members)))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, members: List[BatchMember]) -> None:
+        """
+        发出批量请求并逐个校验各分块的结果；出错的分块（以及出错时尚未处理的分块）按没有得到可用结果处理，
+        异常不离开本任务（没有人等待该任务，只有各分块的 future）
+        """
+        try:
+            with metrics.span("batch_request"):
+                reply = await self._call(members)
+            blocks = split_batch_reply(reply) if reply is not None else {}
+            self.batches += 1
+            for i, member in enumerate(members):
+                generated = blocks.get(i + 1)
+                try:
+                    accepted = generated is not None and await member.file_process.apply_generated(generated) and await member.file_process.validate()
+                except Exception as e:
+                    self.ctx.logger.error(f"file_path:{member.file_process.file_path},批量请求中的分块{i + 1}处理出错：{e!r}")
+                    accepted = False
+                if accepted:
+                    self.batched_chunks += 1
+                else:
+                    self.fallbacks += 1
+                    self.ctx.logger.error(f"file_path:{member.file_process.file_path},批量请求中的分块{i + 1}未得到可用结果，单独重试")
+                metrics.inc("batch_members_total", labels={"outcome": "accepted" if accepted else "fallback"})
+                member.future.set_result(accepted)
+        except Exception as e:
+            self.ctx.logger.error(f"批量请求出错：{e!r}")
+        finally:
+            for member in members:
+                if not member.future.done():
+                    member.future.set_result(False)
+
+    async def _call(self, members: List[BatchMember]) -> Optional[str]:
+        """发出批量请求（可重试的错误按退避重试），返回模型输出；失败时返回 None"""
+        config = self.ctx.config
+        prompt = build_batch_prompt(members)
+        total_tokens = sum(member.tokens for member in members)
+        print(f"\n批量请求：合并{len(members)}个分块（{total_tokens} token）")
+        for attempt in range(config.retry_times):
+            result = await call_llm_api(config, prompt, system_prompt=SYSTEM_PROMPT, limiter=self.ctx.limiter)
+            # token 用量按各分块的代码token数分摊到各自的文件
+            self.ctx.token_usage.record_shared([(member.file_process.file_path, member.tokens) for member in members],
+                                               attempt + 1, result, SYSTEM_PROMPT + prompt, self.ctx.token_counter)
+            if result.get("success"):
+                return result["generated_content"]
+            self.ctx.logger.error(f"批量请求失败，错误信息：{result['error']}")
+            if not result.get("retryable") or attempt + 1 >= config.retry_times:
+                return None
+            await asyncio.sleep(backoff_delay(attempt, config.backoff_base, config.backoff_max, result.get("retry_after")))
+        return None
@@ -0,0 +1,108 @@
+"""
+行对齐基准测试：比较逐行从头扫描（旧实现）与 align.align_lines 的耗时
+
+用法：python benchmark_align.py [--lines 5000] [--drop 0.01] [--seed 0]
+"""
+import argparse
+import random
+import time
+from typing import List, Optional
+from align import align_lines
+from filter_comment import filter_space_and_comment
+
+
+def make_chunk(lines: int, seed: int) -> List[str]:
+    """生成带重复行（花括号、return 等）的合成 C++ 代码片段"""
+    rng = random.Random(seed)
+    result = []
+    while len(result) < lines:
+        name = f"func_{len(result)}"
+        result.append(f"int {name}(int a, int b) {{")
+        for k in range(rng.randint(2, 12)):
+            result.append(f"    int v{k} = a * {rng.randint(0, 999)} + b;")
+            if rng.random() < 0.3:
+                result.append("    if (a > b) {")
+                result.append("        return a;")
+                result.append("    }")
+        result.append("    return b;")
+        result.append("}")
+        result.append("")
+    return result[:lines]
+
+
+def make_generated(source: List[str], drop: float, seed: int) -> List[str]:
+    """模拟模型输出：逐行加注释，偶尔插入纯注释行、漏掉个别行"""
+    rng = random.Random(seed + 1)
+    generated = []
+    for line in source:
+        if line.strip() == "":
+            continue
+        if rng.random() < drop:
+            continue
+        if rng.random() < 0.05:
+            generated.append(line[:len(line)-len(line.lstrip())] + "// 下面一行的说明")
+        generated.append(line + "  // 注释")
+    return generated
+
+
+def legacy_align(source: List[str], generated: List[str], code_type: str) -> List[Optional[int]]:
+    """旧实现：每条源码行都从第 0 条生成行开始比较，每次比较都重新过滤两边"""
+    result = []
+    for line in source:
+        if line.strip() == "":
+            result.append(None)
+            continue
+        i = 0
+        while i < len(generated):
+            if filter_space_and_comment(line, code_type) == filter_space_and_comment(generated[i], code_type):
+                break
+            i += 1
+        result.append(i if i < len(generated) else None)
+    return result
+
+
+def count_misplaced(source: List[str], generated: List[str], mapping: List[Optional[int]]) -> int:
+    """对应到的生成行不是该源码行自身加注释的数量（重复行被匹配到前面的注释上）"""
+    misplaced = 0
+    expected = {}
+    cursor = 0
+    for i, line in enumerate(source):
+        while cursor < len(generated) and not generated[cursor].startswith(line + "  //"):
+            cursor += 1
+        if cursor < len(generated) and line.strip():
+            expected[i] = cursor
+            cursor += 1
+    for i, index in enumerate(mapping):
+        if index is not None and i in expected and expected[i] != index:
+            misplaced += 1
+    return misplaced
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="行对齐基准测试")
+    parser.add_argument("--lines", type=int, default=5000, help="代码片段行数")
+    parser.add_argument("--drop", type=float, default=0.01, help="模型漏掉一行的概率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    source = make_chunk(args.lines, args.seed)
+    generated = make_generated(source, args.drop, args.seed)
+    print(f"源码 {len(source)} 行，生成 {len(generated)} 行")
+
+    start = time.perf_counter()
+    new_mapping = align_lines(source, generated, ".cpp")
+    new_time = time.perf_counter() - start
+    print(f"align_lines：{new_time:.3f}s，匹配 {sum(i is not None for i in new_mapping)} 行，"
+          f"错配 {count_misplaced(source, generated, new_mapping)} 行")
+
+    start = time.perf_counter()
+    old_mapping = legacy_align(source, generated, ".cpp")
+    old_time = time.perf_counter() - start
+    print(f"旧实现：{old_time:.3f}s，匹配 {sum(i is not None for i in old_mapping)} 行，"
+          f"错配 {count_misplaced(source, generated, old_mapping)} 行")
+
+    print(f"加速比：{old_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+端到端吞吐基准测试：在本地模拟接口（mock_server）上对合成代码库运行 main.py，统计吞吐、API 调用和各阶段耗时
+
+用法：python benchmark_e2e.py [--files 20] [--lines 400] [--latency 0.05] [--error-rate 0.02] [--rate-429 0.02]
+                              [--truncate-rate 0.02] [--malformed-rate 0.02] [--stream] [--batch 8] [--rerun] [--keep]
+                              [--timeout 600]
+只测试截断处理：python benchmark_e2e.py --error-rate 0 --rate-429 0 --malformed-rate 0 --truncate-rate 0.2 [--stream]
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from benchmark_align import make_chunk
+from mock_server import MockOptions, create_server
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def make_corpus(root: str, files: int, lines: int, seed: int) -> int:
+    """生成合成 C++ 代码库（分布在若干子目录中），返回总行数"""
+    total = 0
+    for i in range(files):
+        sub_dir = os.path.join(root, f"module_{i % 4}")
+        os.makedirs(sub_dir, exist_ok=True)
+        content = make_chunk(lines, seed + i)
+        # 函数名按文件区分，避免不同文件的代码行在 table 中互相命中
+        content = [line.replace("func_", f"m{i}_func_") for line in content]
+        with open(os.path.join(sub_dir, f"source_{i}.cpp"), "w", encoding="utf-8") as f:
+            f.write("\n".join(content) + "\n")
+        total += len(content)
+    return total
+
+
+def run_main(work_dir: str, timeout: float) -> tuple:
+    """
+    在 work_dir 下运行一次 main.py，返回 (耗时, 输出)
+    main.py 异常退出或超时时以非零退出码结束基准测试，完整输出保存在工作目录的 main_stdout.log / main_stderr.log 中（--keep 保留）
+    """
+    start = time.perf_counter()
+    try:
+        result = subprocess.run([sys.executable, MAIN_PATH, "-i", "in", "-o", "out"], cwd=work_dir,
+                                capture_output=True, text=True, encoding="utf-8", errors="replace", timeout=timeout)
+        stdout, stderr, returncode = result.stdout, result.stderr, result.returncode
+    except subprocess.TimeoutExpired as e:
+        stdout, stderr, returncode = decode_output(e.stdout), decode_output(e.stderr), None
+    elapsed = time.perf_counter() - start
+    if returncode != 0:
+        for name, text in (("main_stdout.log", stdout), ("main_stderr.log", stderr)):
+            with open(os.path.join(work_dir, name), "w", encoding="utf-8") as f:
+                f.write(text)
+        errors = stdout.count("请求过程出错")
+        reason = f"超过 {timeout:g} 秒未退出，已终止" if returncode is None else f"退出码 {returncode}"
+        last_error = next((line for line in reversed(stderr.splitlines()) if line.strip()), "")
+        print(f"\nmain.py 运行失败：{reason}（{elapsed:.2f}s，请求过程出错 {errors} 次）{'：' + last_error if last_error else ''}")
+        raise SystemExit(1 if returncode is None else returncode)
+    return elapsed, stdout
+
+
+def decode_output(output) -> str:
+    """超时时 subprocess 返回的已捕获输出为 bytes（或 None）"""
+    if isinstance(output, bytes):
+        return output.decode("utf-8", errors="replace")
+    return output or ""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="端到端吞吐基准测试")
+    parser.add_argument("--files", type=int, default=20, help="合成文件数")
+    parser.add_argument("--lines", type=int, default=400, help="每个文件的行数")
+    parser.add_argument("--max-tokens", type=int, default=2000, help="config.json 中的 max_tokens（决定分块大小）")
+    parser.add_argument("--concurrency", type=int, default=8, help="config.json 中的 max_concurrency")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟接口每个请求的延迟（秒）")
+    parser.add_argument("--ms-per-token", type=float, default=0.0, help="模拟接口每个输出token的延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--rate-429", type=float, default=0.02)
+    parser.add_argument("--truncate-rate", type=float, default=0.02)
+    parser.add_argument("--malformed-rate", type=float, default=0.02)
+    parser.add_argument("--stream", action="store_true", help="使用 SSE 流式输出")
+    parser.add_argument("--batch", type=int, default=1, help="config.json 中的 batch_max_chunks（大于 1 时合并小分块）")
+    parser.add_argument("--batch-chunk-tokens", type=int, default=200, help="config.json 中的 batch_chunk_tokens")
+    parser.add_argument("--rerun", action="store_true", help="再运行一次，测量全部文件已处理时的耗时")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    parser.add_argument("--timeout", type=float, default=600, help="main.py 单次运行的最长时间（秒），超时视为失败")
+    args = parser.parse_args()
+
+    options = MockOptions(args.latency, args.ms_per_token, args.error_rate, args.rate_429, 0.2,
+                          args.truncate_rate, args.malformed_rate, seed=args.seed)
+    server = create_server(options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    work_dir = tempfile.mkdtemp(prefix="easysrc_bench_")
+    try:
+        total_lines = make_corpus(os.path.join(work_dir, "in"), args.files, args.lines, args.seed)
+        with open(os.path.join(work_dir, "config.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "api_key": "mock", "api_url": f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions",
+                "model": "mock", "max_tokens": args.max_tokens, "text_extensions": [".cpp"],
+                "max_concurrency": args.concurrency, "stream": args.stream, "backoff_base": 0.1,
+                "batch_max_chunks": args.batch, "batch_chunk_tokens": args.batch_chunk_tokens,
+                "metrics_path": "metrics.json"
+            }, f)
+        print(f"合成代码库：{args.files} 个文件，{total_lines} 行；工作目录 {work_dir}")
+
+        start = time.time()
+        elapsed, stdout = run_main(work_dir, args.timeout)
+        stats = server.state.snapshot()
+
+        attempts = [int(n) for n in re.findall(r"第(\d+)次尝试调用API", stdout)]
+        chunks = sum(1 for path in glob.glob(os.path.join(work_dir, "out", "**", "*.resume"), recursive=True)
+                     for _ in open(path, encoding="utf-8"))
+        failed = stdout.count("生成失败，将原文写入")
+        splits = stdout.count("拆分代码片段后重试") + stdout.count("代码块数量不为1")
+        print(f"\n总耗时：{elapsed:.2f}s")
+        print(f"文件/秒：{args.files / elapsed:.2f}，分块/秒：{chunks / elapsed:.2f}（提交 {chunks} 个分块，失败 {failed} 个）")
+        print(f"API 请求：{int(stats['requests'])} 次，每分块 {stats['requests'] / max(chunks, 1):.2f} 次；"
+              f"重试 {sum(1 for n in attempts if n > 1)} 次，截断/多代码块拆分 {splits} 次，请求过程出错 {stdout.count('请求过程出错')} 次")
+        print(f"模拟接口：500 {int(stats['errors_500'])} 次，429 {int(stats['errors_429'])} 次，"
+              f"截断 {int(stats['truncated'])} 次，多代码块 {int(stats['malformed'])} 次，"
+              f"输出token {int(stats['completion_tokens'])}")
+        if stats["first_request_at"]:
+            # 按模拟接口收到第一个请求、返回最后一个响应的时间划分阶段
+            print("各阶段耗时：")
+            print(f"  启动、遍历与切分（到第一个请求）：{stats['first_request_at'] - start:.2f}s")
+            print(f"  API 阶段（第一个请求到最后一个响应）：{stats['last_response_at'] - stats['first_request_at']:.2f}s")
+            print(f"  收尾（最后一个响应到退出）：{start + elapsed - stats['last_response_at']:.2f}s")
+        metrics_path = os.path.join(work_dir, "metrics.json")
+        if os.path.exists(metrics_path):
+            # main.py 写出的各阶段指标（并发执行的阶段累计耗时可能超过总耗时）
+            with open(metrics_path, encoding="utf-8") as f:
+                histograms = json.load(f)["histograms"]
+            print("main.py 各阶段累计耗时：")
+            for name, histogram in sorted(histograms.items(), key=lambda item: -item[1]["sum"]):
+                print(f"  {name[:-len('_seconds')]}：{histogram['sum']:.3f}s / {histogram['count']} 次")
+
+        if args.rerun:
+            requests_before = stats["requests"]
+            elapsed, _ = run_main(work_dir, args.timeout)
+            print(f"\n再次运行（全部已处理）：{elapsed:.2f}s，API 请求 {int(server.state.snapshot()['requests'] - requests_before)} 次")
+    finally:
+        server.shutdown()
+        server.server_close()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
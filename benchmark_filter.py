@@ -0,0 +1,181 @@
+"""
+注释过滤基准测试：比较逐字符循环的旧实现与 filter_comment 中单次正则扫描的耗时
+
+用法：python benchmark_filter.py [文件 ...] [--lines 50000] [--repeat 5]
+不指定文件时生成一个合成的大型 C++ 头文件
+"""
+import argparse
+import os
+import time
+from typing import Callable, Dict, List, Tuple
+from filter_comment import filter_comment_from_code
+
+
+# ---- 旧实现（逐字符循环，仅用于对比） ----
+
+def legacy_python(code: str) -> str:
+    """过滤 Python 注释（# 单行注释、多行注释）"""
+    lines = code.split('\n')
+    result = []
+    in_multiline = False  # 是否在多行注释中
+    multiline_delim = None  # 多行注释分隔符（''' 或 """）
+    
+    for line in lines:
+        i = 0
+        n = len(line)
+        new_line = []
+        
+        while i < n:
+            if in_multiline:
+                # 查找多行注释结束符
+                if line.startswith(multiline_delim, i):
+                    in_multiline = False
+                    i += len(multiline_delim)
+                else:
+                    i += 1
+            else:
+                # 单行注释 #
+                if line.startswith('#', i):
+                    break  # 忽略 # 后的内容
+                # 多行注释开始（''' 或 """）
+                elif line.startswith('"""', i):
+                    in_multiline = True
+                    multiline_delim = '"""'
+                    i += 3
+                elif line.startswith("'''", i):
+                    in_multiline = True
+                    multiline_delim = "'''"
+                    i += 3
+                else:
+                    new_line.append(line[i])
+                    i += 1
+        
+        result.append(''.join(new_line))
+    
+    return '\n'.join(result)
+
+
+def legacy_c_style(code: str) -> str:
+    """过滤 C 风格注释（// 单行注释、/* */ 多行注释），适用于 JS/Java/C/C++"""
+    lines = code.split('\n')
+    result = []
+    in_multiline = False  # 是否在 /* */ 多行注释中
+    
+    for line in lines:
+        i = 0
+        n = len(line)
+        new_line = []
+        
+        while i < n:
+            if in_multiline:
+                # 查找多行注释结束符 */
+                if i + 1 < n and line[i] == '*' and line[i+1] == '/':
+                    in_multiline = False
+                    i += 2  # 跳过 */
+                else:
+                    i += 1
+            else:
+                # 单行注释 //
+                if i + 1 < n and line[i] == '/' and line[i+1] == '/':
+                    break  # 忽略 // 后的内容
+                # 多行注释开始 /*
+                elif i + 1 < n and line[i] == '/' and line[i+1] == '*':
+                    in_multiline = True
+                    i += 2  # 跳过 /*
+                else:
+                    new_line.append(line[i])
+                    i += 1
+        
+        result.append(''.join(new_line))
+    
+    return '\n'.join(result)
+
+
+def legacy_html(code: str) -> str:
+    """过滤 HTML 注释（<!-- -->，支持跨多行）"""
+    lines = code.split('\n')
+    result = []
+    in_comment = False  # 是否在 <!-- --> 注释中
+    
+    for line in lines:
+        i = 0
+        n = len(line)
+        new_line = []
+        
+        while i < n:
+            if in_comment:
+                # 查找注释结束符 -->
+                if i + 2 < n and line[i] == '-' and line[i+1] == '-' and line[i+2] == '>':
+                    in_comment = False
+                    i += 3  # 跳过 -->
+                else:
+                    i += 1
+            else:
+                # 查找注释开始符 <!--
+                if i + 3 < n and line[i] == '<' and line[i+1] == '!' and line[i+2] == '-' and line[i+3] == '-':
+                    in_comment = True
+                    i += 4  # 跳过 <!--
+                else:
+                    new_line.append(line[i])
+                    i += 1
+        
+        result.append(''.join(new_line))
+    
+    return '\n'.join(result)
+
+
+LEGACY: Dict[str, Callable[[str], str]] = {".py": legacy_python, ".html": legacy_html}
+
+
+def make_header(lines: int) -> str:
+    """生成带大量行尾注释、块注释和字符串的合成 C++ 头文件"""
+    result = []
+    k = 0
+    while len(result) < lines:
+        result.append(f"/* 函数 {k} 的说明")
+        result.append(f" * 参数 a、b */")
+        result.append(f"template <class _Ty> inline _Ty func_{k}(_Ty a, _Ty b) {{  // 行尾注释 {k}")
+        result.append(f"    const char* s = \"value {k}\";  // 字符串")
+        result.append(f"    return a * {k} + b; /* 块注释 */")
+        result.append("}")
+        result.append("")
+        k += 1
+    return "\n".join(result[:lines])
+
+
+def run(name: str, func: Callable[[str], str], code: str, repeat: int) -> Tuple[float, str]:
+    best = float("inf")
+    output = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func(code)
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="注释过滤基准测试")
+    parser.add_argument("files", nargs="*", help="参与测试的源文件，不指定则使用合成头文件")
+    parser.add_argument("--lines", type=int, default=50000, help="合成头文件的行数")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数（取最快一次）")
+    args = parser.parse_args()
+
+    samples: List[Tuple[str, str, str]] = []
+    for path in args.files:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            samples.append((path, f.read(), os.path.splitext(path)[1].lower()))
+    if not samples:
+        samples.append((f"合成头文件（{args.lines} 行）", make_header(args.lines), ".h"))
+
+    for name, code, code_type in samples:
+        legacy = LEGACY.get(code_type, legacy_c_style)
+        old_time, old_output = run("旧实现", legacy, code, args.repeat)
+        new_time, new_output = run("新实现", lambda text: filter_comment_from_code(text, code_type), code, args.repeat)
+        same = "一致" if old_output == new_output else "不一致（旧实现会截断字符串中的 // 或 #）"
+        print(f"{name}：{len(code) / 1024:.0f} KB")
+        print(f"  旧实现 {old_time * 1000:.1f} ms，新实现 {new_time * 1000:.1f} ms，"
+              f"加速比 {old_time / new_time:.1f}x，输出{same}")
+
+
+if __name__ == "__main__":
+    main()
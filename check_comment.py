@@ -1,12 +1,7 @@
 from file import read_files
-from filter_comment import filter_comment_from_code
+from filter_comment import filter_comment_from_code, filter_space, filter_space_and_comment
 import os
-
-def filter_space(content: str) -> str:
-    return content.replace(" ", "").replace("\n", "").replace("\t", "").replace("\r", "").replace("\v", "").replace("\f", "")
-
-def filter_space_and_comment(content: str, code_type: str) -> str:
-    return filter_space(filter_comment_from_code(content, code_type))
+from typing import Optional
 
 def check_code(file_path: str, comment_path: str) -> bool:
     file=read_files(file_path)[file_path]
@@ -22,6 +17,50 @@ def check_code(file_path: str, comment_path: str) -> bool:
 def check_code_with_content(content: str, comment_content: str, code_type: str) -> bool:
     return filter_space_and_comment(content, code_type)==filter_space_and_comment(comment_content, code_type)
 
+def reapply_comment(line: str, commented_line: str, code_type: str) -> str:
+    """
+    把 commented_line 上的注释套用到 line 上（两者去掉空白和注释后须相同）
+    注释在行尾时保留 line 的原始代码文本，否则只把缩进换成 line 的缩进
+    """
+    code = filter_comment_from_code(commented_line, code_type).rstrip()
+    if code and commented_line.startswith(code):
+        return line.rstrip() + commented_line[len(code):]
+    return line[:len(line)-len(line.lstrip())] + commented_line.lstrip()
+
+def reapply_chunk(content: str, commented_content: str, code_type: str) -> Optional[str]:
+    """
+    把已注释的代码块按行套用到 content 上，保留 content 自身的缩进、空白和空行
+    只有注释的行放在其后第一行代码之前；行无法一一对应时返回 None
+    """
+    commented_lines = []  # [(去掉空白和注释后的代码, 之前的纯注释行, 该行)]
+    pending = []
+    for commented_line in commented_content.split("\n"):
+        normalized = filter_space_and_comment(commented_line, code_type)
+        if normalized == "":
+            if commented_line.strip() != "":
+                pending.append(commented_line)
+            continue
+        commented_lines.append((normalized, pending, commented_line))
+        pending = []
+    result = []
+    index = 0
+    for line in content.split("\n"):
+        normalized = filter_space_and_comment(line, code_type)
+        if normalized == "":
+            result.append(line)
+            continue
+        if index >= len(commented_lines) or commented_lines[index][0] != normalized:
+            return None
+        _, comments, commented_line = commented_lines[index]
+        indent = line[:len(line)-len(line.lstrip())]
+        result.extend(indent + comment.lstrip() for comment in comments)
+        result.append(reapply_comment(line, commented_line, code_type))
+        index += 1
+    if index != len(commented_lines):
+        return None
+    result.extend(pending)
+    return "\n".join(result)
+
 def minDistance(word1: str, word2: str) -> int:
     n1 = len(word1)
     n2 = len(word2)
@@ -0,0 +1,59 @@
+import hashlib
+import os
+import sqlite3
+from typing import Optional
+
+
+class ChunkCache:
+    """
+    按内容寻址的分块结果缓存（SQLite 持久化）
+
+    键为 (模型, 提示词版本, 代码类型, 去掉空白和注释后的代码) 的哈希，
+    值为校验通过的带注释代码；缩进或空白不同、但代码相同的分块可以直接复用
+    """
+
+    def __init__(self, db_path: str = "chunk_cache.db"):
+        self.db_path = db_path
+        dir_path = os.path.dirname(db_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        # 多个工作进程可能共用同一个缓存（回滚日志，可放在共享文件系统上），其他进程持有写锁时最多等待 30 秒
+        self._conn = sqlite3.connect(db_path, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (key TEXT PRIMARY KEY, content TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(normalized_code: str, code_type: str, model: str, prompt_version: str) -> str:
+        """计算缓存键，normalized_code 为 filter_space_and_comment 处理后的代码"""
+        digest = hashlib.sha256()
+        for part in (model, prompt_version, code_type, normalized_code):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT content FROM chunks WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, content: str) -> bool:
+        """写入一个分块结果，成功返回 True（缓存只是加速手段，写入失败时丢弃该条结果）"""
+        try:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO chunks (key, content) VALUES (?, ?)", (key, content)
+                )
+            return True
+        except sqlite3.Error as e:
+            print(f"保存分块缓存失败：{str(e)}")
+            return False
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,101 @@
+import re
+from typing import List, Tuple
+from tokenizer import TokenCounter
+
+# 按花括号划分作用域的语言（与 filter_comment 中的 C 风格类型一致，"" 为无后缀的头文件）
+C_STYLE_TYPES = (".js", ".java", ".c", ".cpp", ".h", ".hpp", ".c++", "")
+
+_LITERAL_RE = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'')
+_TRANSPARENT_SCOPE_RE = re.compile(r'(?:inline\s+)?namespace\b|extern\s*"C"')
+_PY_DEFINITION_RE = re.compile(r'(?:async\s+def|def|class)\b|@')
+
+
+def compute_chunk_budget(max_tokens: int, context_window: int, target_ratio: float,
+                         comment_ratio: float, prompt_overhead: int) -> int:
+    """
+    计算单个分块的代码token预算
+
+    输出包含代码本身和新增注释，约为代码的 (1 + comment_ratio) 倍，须放进 max_tokens 的 target_ratio 以内；
+    已知上下文窗口时，提示词开销 + 输入代码 + 输出也须放进窗口的 target_ratio 以内
+    """
+    budget = max_tokens * target_ratio / (1 + comment_ratio)
+    if context_window > 0:
+        budget = min(budget, (context_window * target_ratio - prompt_overhead) / (2 + comment_ratio))
+    return max(1, int(budget))
+
+
+def boundary_scores(lines: List[str], code_type: str) -> List[int]:
+    """
+    每行之前作为分块边界的优先级
+    3：顶层定义之间（函数、类等结束后或顶层空行），2：其他顶层语句，1：作用域内的空行，0：不宜切分
+    """
+    scores = []
+    if code_type in C_STYLE_TYPES:
+        # 花括号栈，namespace / extern "C" 的花括号不算作用域深度
+        braces = []
+        depth = 0
+        closed_top_level = True  # 上一行是否结束了一个顶层结构（或是开头）
+        for line in lines:
+            stripped = line.strip()
+            if depth == 0:
+                scores.append(3 if stripped == "" or closed_top_level else 2)
+            else:
+                scores.append(1 if stripped == "" else 0)
+            code = _LITERAL_RE.sub("", stripped)
+            opens_transparent = transparent = _TRANSPARENT_SCOPE_RE.match(code) is not None
+            for ch in code:
+                if ch == "{":
+                    braces.append(transparent)
+                    depth += 0 if transparent else 1
+                    transparent = False
+                elif ch == "}" and braces:
+                    depth -= 0 if braces.pop() else 1
+            if stripped != "":
+                closed_top_level = depth == 0 and (opens_transparent or stripped.endswith("}") or stripped.endswith("};"))
+    elif code_type == ".py":
+        for line in lines:
+            stripped = line.strip()
+            if stripped == "":
+                scores.append(1)
+            elif line[0] not in " \t":
+                scores.append(3 if _PY_DEFINITION_RE.match(stripped) else 2)
+            else:
+                scores.append(0)
+    else:
+        for line in lines:
+            if line.strip() == "":
+                scores.append(1)
+            else:
+                scores.append(2 if line[0] not in " \t" else 0)
+    return scores
+
+
+def split_into_chunk_spans(lines: List[str], code_type: str, count_tokens: TokenCounter,
+                           budget: int, min_fill: float = 0.5) -> List[Tuple[int, int]]:
+    """
+    按token预算把文件内容（按行）切成若干分块，返回每个分块的行区间 [start, end)
+
+    尽量把分块填到预算附近：在已填满 min_fill 之后的候选边界中，选优先级最高（相同则最靠后）的位置切分；
+    没有合适边界时在预算用尽处硬切。单行超过预算时独占一个分块
+    在空行处切分时丢弃该空行（不属于任何分块，写入输出时每个分块末尾会补一个换行）
+    """
+    costs = [count_tokens(line + "\n") for line in lines]
+    scores = boundary_scores(lines, code_type)
+    spans = []
+    start = 0
+    n = len(lines)
+    while start < n:
+        total = 0
+        end = start
+        best_score, best_index = 0, -1
+        while end < n and (end == start or total + costs[end] <= budget):
+            if end > start and scores[end] > 0 and scores[end] >= best_score and total >= budget * min_fill:
+                best_score, best_index = scores[end], end
+            total += costs[end]
+            end += 1
+        cut = best_index if end < n and best_index != -1 else end
+        spans.append((start, cut))
+        start = cut
+        if start < n and lines[start] == "":
+            start += 1
+    return spans
@@ -4,6 +4,8 @@ from typing import Dict, List, Optional
 
 
 class Config:
+    BOOL_FIELDS = ("stream", "table_fuzzy", "partial_reuse", "diff_reannotate", "output_fsync")
+
     def __init__(self, config_path: str = "config.json"):
         """
         初始化配置类，读取并解析配置文件
@@ -56,7 +58,21 @@ class Config:
         for ext in self._config["text_extensions"]:
             if not isinstance(ext, str):
                 raise TypeError(f"text_extensions 包含非字符串元素: {ext}")
+        # 布尔配置项在启动时检查，避免 "false" 之类的字符串被当作真值
+        for field in self.BOOL_FIELDS:
+            self._get_bool(field, False)
             
+    def _get_bool(self, key: str, default: bool) -> bool:
+        """读取布尔配置项：接受 true/false，以及字符串 "true"/"false"、"1"/"0"、"yes"/"no"、"on"/"off" 和整数 1/0"""
+        value = self._config.get(key, default)
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int) and value in (0, 1):
+            return bool(value)
+        if isinstance(value, str) and value.strip().lower() in ("true", "1", "yes", "on", "false", "0", "no", "off"):
+            return value.strip().lower() in ("true", "1", "yes", "on")
+        raise TypeError(f"配置项 {key} 类型错误，期望布尔值，实际 {value!r}")
+
     @property
     def api_key(self) -> str:
         """获取 API 密钥"""
@@ -83,6 +99,226 @@ class Config:
         """获取需要处理的文件后缀列表"""
         return self._config["text_extensions"].copy()  # 返回副本防止外部修改
 
+    @property
+    def pool_size(self) -> int:
+        """获取每个 API host 的 keep-alive 连接池大小（可选，默认 8）"""
+        return int(self._config.get("pool_size", 8))
+
+    @property
+    def max_concurrency(self) -> int:
+        """获取全局同时在途的分块（API请求）数量上限（可选，默认 8）"""
+        return int(self._config.get("max_concurrency", 8))
+
+    @property
+    def requests_per_minute(self) -> float:
+        """获取每分钟请求数上限（可选，默认 0 表示不限制，被限流后自动学习）"""
+        return float(self._config.get("requests_per_minute", 0))
+
+    @property
+    def tokens_per_minute(self) -> float:
+        """获取每分钟token数上限（可选，默认 0 表示不限制）"""
+        return float(self._config.get("tokens_per_minute", 0))
+
+    @property
+    def retry_times(self) -> int:
+        """获取每个分块调用API的最大尝试次数（可选，默认 3）"""
+        return int(self._config.get("retry_times", 3))
+
+    @property
+    def backoff_base(self) -> float:
+        """获取重试退避的基础等待秒数（可选，默认 1）"""
+        return float(self._config.get("backoff_base", 1))
+
+    @property
+    def backoff_max(self) -> float:
+        """获取重试退避的最大等待秒数（可选，默认 60）"""
+        return float(self._config.get("backoff_max", 60))
+
+    @property
+    def context_window(self) -> int:
+        """获取模型上下文窗口大小（可选，默认 0 表示未知，只按 max_tokens 计算分块大小）"""
+        return int(self._config.get("context_window", 0))
+
+    @property
+    def chunk_target_ratio(self) -> float:
+        """获取分块填充目标：输出占 max_tokens（及上下文窗口）的比例（可选，默认 0.8）"""
+        return float(self._config.get("chunk_target_ratio", 0.8))
+
+    @property
+    def comment_ratio(self) -> float:
+        """获取为注释预留的输出比例：新增注释token约为代码token的多少倍（可选，默认 1.5）"""
+        return float(self._config.get("comment_ratio", 1.5))
+
+    @property
+    def tokenizer(self) -> str:
+        """获取分块使用的分词器："heuristic"（默认）或 "tiktoken[:编码名]"（需安装 tiktoken）"""
+        return self._config.get("tokenizer", "heuristic")
+
+    @property
+    def stream(self) -> bool:
+        """获取是否使用流式输出（可选，默认 False），开启后边接收边校验，输出偏离源码或将被截断时提前中止"""
+        return self._get_bool("stream", False)
+
+    @property
+    def table_path(self) -> str:
+        """获取代码行注释对照表数据库路径（可选，默认 table.db，首次运行时自动导入旧的 table.json）"""
+        return self._config.get("table_path", "table.db")
+
+    @property
+    def table_fuzzy(self) -> bool:
+        """获取是否按规范化代码复用 table 中的注释（可选，默认 true），缩进或空白不同的同一行代码套用已有注释"""
+        return self._get_bool("table_fuzzy", True)
+
+    @property
+    def partial_reuse(self) -> bool:
+        """获取是否部分复用 table 中的注释（可选，默认 true），分块中大部分代码行已有注释时只为其余部分调用API"""
+        return self._get_bool("partial_reuse", True)
+
+    @property
+    def partial_reuse_min_ratio(self) -> float:
+        """获取部分复用要求的已有注释代码行比例（可选，默认 0.5）"""
+        return float(self._config.get("partial_reuse_min_ratio", 0.5))
+
+    @property
+    def partial_context_lines(self) -> int:
+        """获取部分复用时没有注释的代码前后附带的上下文行数（可选，默认 2）"""
+        return int(self._config.get("partial_context_lines", 2))
+
+    @property
+    def chunk_cache_path(self) -> str:
+        """获取分块结果缓存数据库路径（可选，默认 chunk_cache.db）"""
+        return self._config.get("chunk_cache_path", "chunk_cache.db")
+
+    @property
+    def encoding_cache_path(self) -> str:
+        """获取编码检测结果缓存数据库路径（可选，默认 encoding_cache.db）"""
+        return self._config.get("encoding_cache_path", "encoding_cache.db")
+
+    @property
+    def manifest_path(self) -> str:
+        """获取已处理文件指纹清单的数据库路径（可选，默认 manifest.db）"""
+        return self._config.get("manifest_path", "manifest.db")
+
+    @property
+    def diff_reannotate(self) -> bool:
+        """获取源码有改动时是否只重新注释改动部分（可选，默认 True）"""
+        return self._get_bool("diff_reannotate", True)
+
+    @property
+    def diff_context_lines(self) -> int:
+        """获取重新注释改动部分时前后附带的上下文代码行数（可选，默认 3）"""
+        return int(self._config.get("diff_context_lines", 3))
+
+    @property
+    def metrics_path(self) -> Optional[str]:
+        """获取运行结束时写入指标汇总的文件路径（可选，默认不写入）"""
+        return self._config.get("metrics_path") or None
+
+    @property
+    def metrics_format(self) -> str:
+        """获取指标汇总的格式（可选，json 或 prometheus，默认 json）"""
+        return self._config.get("metrics_format", "json")
+
+    @property
+    def metrics_port(self) -> int:
+        """获取实时提供指标的本地端口（可选，默认 0 表示不提供）"""
+        return int(self._config.get("metrics_port", 0))
+
+    @property
+    def batch_max_chunks(self) -> int:
+        """获取一个批量请求最多合并的小分块数（可选，默认 1 表示不合并）"""
+        return int(self._config.get("batch_max_chunks", 1))
+
+    @property
+    def batch_chunk_tokens(self) -> int:
+        """获取可以合并到批量请求中的分块的token上限（可选，默认 200）"""
+        return int(self._config.get("batch_chunk_tokens", 200))
+
+    @property
+    def batch_wait(self) -> float:
+        """获取小分块等待凑成一批的最长时间（秒，可选，默认 0.05）"""
+        return float(self._config.get("batch_wait", 0.05))
+
+    @property
+    def usage_path(self) -> Optional[str]:
+        """获取运行结束时写入按文件、按重试次数汇总的token用量的文件路径（可选，默认不写入）"""
+        return self._config.get("usage_path") or None
+
+    @property
+    def prompt_price(self) -> float:
+        """获取每千输入token的价格（可选，默认 0 表示不计费用）"""
+        return float(self._config.get("prompt_price", 0))
+
+    @property
+    def completion_price(self) -> float:
+        """获取每千输出token的价格（可选，默认 0 表示不计费用）"""
+        return float(self._config.get("completion_price", 0))
+
+    @property
+    def estimate_call_seconds(self) -> float:
+        """获取 --dry-run 估算耗时时每次API调用的固定耗时（秒，可选，默认 2）"""
+        return float(self._config.get("estimate_call_seconds", 2))
+
+    @property
+    def estimate_output_tokens_per_second(self) -> float:
+        """获取 --dry-run 估算耗时时模型每秒输出的token数（可选，默认 50）"""
+        return float(self._config.get("estimate_output_tokens_per_second", 50))
+
+    @property
+    def cpu_workers(self) -> int:
+        """获取规范化、对齐和校验使用的进程数（可选，默认为 CPU 核数，0 表示在主进程中计算），与网络并发数 max_concurrency 分开配置"""
+        return int(self._config.get("cpu_workers", os.cpu_count() or 1))
+
+    @property
+    def cpu_offload_min_chars(self) -> int:
+        """获取放到进程池中计算的分块的最少字符数（可选，默认 8192），更小的分块传输开销大于计算本身，直接在主进程中计算"""
+        return int(self._config.get("cpu_offload_min_chars", 8192))
+
+    @property
+    def output_commit_bytes(self) -> int:
+        """获取输出文件成批写入的字节数（可选，默认 65536），攒够后一次性写入并记录断点，文件处理结束时写入剩余部分"""
+        return int(self._config.get("output_commit_bytes", 65536))
+
+    @property
+    def output_fsync(self) -> bool:
+        """获取每批输出写入后是否 fsync（可选，默认 true），保证断点索引记录的输出已经落盘"""
+        return self._get_bool("output_fsync", True)
+
+    @property
+    def work_queue_path(self) -> str:
+        """获取多进程模式的工作队列路径（可选，默认 work_queue.db），多台机器协作时放在共享文件系统上"""
+        return self._config.get("work_queue_path", "work_queue.db")
+
+    @property
+    def lease_seconds(self) -> float:
+        """获取工作进程领取分块的租约时长（秒，可选，默认 120），处理期间每三分之一个时长续约一次"""
+        return float(self._config.get("lease_seconds", 120))
+
+    @property
+    def lease_max_attempts(self) -> int:
+        """获取同一分块最多被领取的次数（可选，默认 3），租约过期达到该次数后按生成失败处理"""
+        return int(self._config.get("lease_max_attempts", 3))
+
+    @property
+    def worker_poll_seconds(self) -> float:
+        """获取工作进程等待其他进程的租约过期时查看队列的间隔（秒，可选，默认 2）"""
+        return float(self._config.get("worker_poll_seconds", 2))
+
+    @property
+    def read_workers(self) -> int:
+        """获取读取、解码源文件的线程数（可选，默认 4）"""
+        return int(self._config.get("read_workers", 4))
+
+    @property
+    def max_pending_files(self) -> int:
+        """获取同时在处理中的文件数上限（可选，默认 16），限制大目录树的内存占用"""
+        return int(self._config.get("max_pending_files", 16))
+
+    @property
+    def normalize_cache_mb(self) -> float:
+        """获取规范化结果内存缓存的容量上限（MB，可选，默认 64，0 表示不缓存）"""
+        return float(self._config.get("normalize_cache_mb", 64))
+
     def get(self, key: str, default: Optional[any] = None) -> any:
         """
         获取配置项（支持获取非预定义的额外配置）
@@ -106,7 +342,6 @@ class Config:
                 masked_config["api_key"] = api_key[:3] + "***" + api_key[-3:]
         return json.dumps(masked_config, indent=2, ensure_ascii=False)
 
-config = Config()
 # 使用示例
 # if __name__ == "__main__":
 #     try:
@@ -0,0 +1,73 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple, TypeVar
+from align import align_lines
+from check_comment import check_code_with_content
+from filter_comment import filter_space_and_comment
+
+T = TypeVar("T")
+
+
+def analyze_generated(content: str, generated: str, code_type: str) -> Tuple[List[Optional[int]], bool]:
+    """
+    对齐源码行与生成行，并校验生成结果去掉注释后是否与源码一致
+    在工作进程中执行：参数和返回值只有字符串、行号列表和布尔值，传输开销小
+    """
+    mapping = align_lines(content.split("\n"), generated.split("\n"), code_type)
+    return mapping, check_code_with_content(generated, content, code_type)
+
+
+def collect_unmatched_comments(lines: List[str], generated: str, code_type: str) -> List[str]:
+    """
+    为对齐时没有找到对应生成行的源码行拼出注释行（模型把一行拆成了多行时）：
+    依次拼接规范化后包含于该行的生成行，直到与该行一致
+    """
+    generated_lines = generated.split("\n")
+    generated_keys = [filter_space_and_comment(generated_line, code_type) for generated_line in generated_lines]
+    comments = []
+    for line in lines:
+        key = filter_space_and_comment(line, code_type)
+        comment = ""
+        for generated_line, generated_key in zip(generated_lines, generated_keys):
+            if generated_key in key:
+                comment += generated_line
+                if check_code_with_content(line, comment, code_type):
+                    break
+        comments.append(comment)
+    return comments
+
+
+class CpuPool:
+    """
+    CPU 密集的规范化、对齐和校验放到进程池中执行，不阻塞事件循环，也不受 GIL 限制
+
+    进程数（workers）与网络并发数（max_concurrency）分开配置；workers 为 0 时直接在当前进程计算。
+    输入少于 min_chars 个字符的任务传输开销大于计算本身，也直接在当前进程计算。
+    进程池在第一次使用时才创建，工作进程以 spawn 方式启动（各模块导入时没有副作用，启动代价小）
+    """
+
+    def __init__(self, workers: int, min_chars: int = 0):
+        self.workers = max(0, workers)
+        self.min_chars = min_chars
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.offloaded = 0  # 在进程池中执行的任务数
+        self.inline = 0  # 直接在当前进程执行的任务数
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def run(self, size: int, func: Callable[..., T], *args) -> T:
+        """执行 func(*args)，size 为输入的字符数，决定是否值得放到进程池中；func 须为模块级函数"""
+        if self.workers == 0 or size < self.min_chars:
+            self.inline += 1
+            return func(*args)
+        self.offloaded += 1
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
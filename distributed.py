@@ -0,0 +1,150 @@
+import asyncio
+import os
+import sqlite3
+from functools import partial
+from typing import Dict, Iterator, List, Tuple
+from init_project import AppContext
+from file import read_source_file, atomic_write
+from file_process import FileProcess, chunk_token_budget
+from scheduler import ChunkScheduler
+from batcher import ChunkBatcher
+from chunker import split_into_chunk_spans
+from check_comment import check_code_with_content
+from resume_index import ResumeIndex, ResumeRecord, PrefixHasher
+from work_queue import WorkQueue, WorkUnit, FileJob
+from output_writer import OutputWriter
+from metrics import metrics
+
+
+def enqueue_files(ctx: AppContext, queue: WorkQueue, files: Iterator[Tuple[str, List[str]]], budget: int) -> Tuple[int, int]:
+    """
+    协调进程：把需要处理的文件按token预算切分后加入工作队列，返回加入的文件数和分块数
+    规范化内容未变化、或已有输出且与源码一致的文件不加入
+    """
+    queue.set_meta("input", os.path.abspath(ctx.params["input"]))
+    queue.set_meta("output", os.path.abspath(ctx.params["output"]))
+    queued_files = queued_units = 0
+    for file_path, content in files:
+        comment_path = ctx.output_path_for(file_path)
+        code_type = os.path.splitext(file_path)[1].lower()
+        if ctx.manifest.is_same_content(file_path, comment_path, content, code_type):
+            continue
+        if os.path.isfile(comment_path):
+            comment_content = read_source_file(comment_path, False, ctx.encoding_cache)
+            if comment_content is not None and check_code_with_content("\n".join(content), "\n".join(comment_content), code_type):
+                ctx.manifest.record(file_path, comment_path, content, code_type)
+                continue
+        spans = split_into_chunk_spans(content, code_type, ctx.token_counter, budget) or [(0, 0)]
+        if queue.enqueue(file_path, comment_path, content, code_type, spans):
+            queued_files += 1
+            queued_units += len(spans)
+    return queued_files, queued_units
+
+
+def assemble_output(job: FileJob) -> Tuple[str, List[ResumeRecord], bool]:
+    """
+    按分块顺序拼接输出（与 split_file_and_process 逐块追加写入的内容相同，失败的分块写入原文），
+    返回输出内容、断点索引记录（只记录连续成功的分块）和是否全部成功
+    """
+    hasher = PrefixHasher(job.code_type)
+    parts, records = [], []
+    offset = 0
+    success = True
+    for unit in job.units:
+        text = (unit.result if unit.success else unit.content) + "\n"
+        parts.append(text)
+        offset += len(OutputWriter.encode(text))
+        success = success and unit.success
+        if success:
+            hasher.update(job.content[hasher.line:unit.end])
+            records.append(ResumeRecord(unit.end, hasher.hexdigest(), offset))
+    return "".join(parts), records, success
+
+
+def write_output(job: FileJob, text: str, records: List[ResumeRecord]) -> None:
+    atomic_write(job.output_path, text)
+    ResumeIndex(job.output_path).reset(records)
+
+
+async def keep_lease(ctx: AppContext, queue: WorkQueue, unit: WorkUnit, worker: str) -> None:
+    """处理分块期间每隔三分之一个租约时长续约一次"""
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        if not await queue.run(queue.renew, unit, worker):
+            ctx.logger.error(f"file_path:{unit.file_path},分块{unit.index}的租约已过期并被其他进程领取")
+            return
+
+
+async def process_unit(ctx: AppContext, queue: WorkQueue, scheduler: ChunkScheduler, worker: str, unit: WorkUnit) -> None:
+    """生成一个分块的注释并提交到队列；租约已失效时结果被丢弃（table 和分块缓存中的结果仍然保留）"""
+    file_process = FileProcess(ctx, unit.file_path, unit.content)
+    heartbeat = asyncio.ensure_future(keep_lease(ctx, queue, unit, worker))
+    try:
+        success = await scheduler.run(partial(file_process.generate, scheduler.batcher))
+        if not ctx.table.commit():
+            # table 只是缓存，提交失败不影响本分块的结果，未写入的改动留在内存中下次提交时重试
+            ctx.logger.error(f"file_path:{unit.file_path},分块{unit.index}的 table 改动暂未保存，下次提交时重试")
+    finally:
+        heartbeat.cancel()
+    if not success:
+        print(f"{unit.file_path}生成失败，将原文写入")
+        ctx.logger.error(f"{unit.file_path}生成失败，将原文写入")
+    committed = await queue.run(queue.complete, unit, worker, file_process.generate_content if success else None, success)
+    metrics.inc("work_units_total", labels={"outcome": ("success" if success else "failed") if committed else "lease_lost"})
+
+
+async def write_file(ctx: AppContext, queue: WorkQueue, job: FileJob, worker: str) -> None:
+    """原子写出分块已全部完成的文件，更新断点索引和指纹清单"""
+    text, records, success = assemble_output(job)
+    await asyncio.get_running_loop().run_in_executor(None, write_output, job, text, records)
+    if success:
+        ctx.manifest.record(job.file_path, job.output_path, job.content, job.code_type)
+    else:
+        ctx.manifest.forget(job.file_path)
+    if await queue.run(queue.finish_file, job, worker, success):
+        print(f"已写出文件：{job.output_path}{'' if success else '（部分分块生成失败）'}")
+
+
+async def run_worker(ctx: AppContext, queue: WorkQueue, worker: str) -> None:
+    """
+    工作进程：不断从队列领取分块并生成注释，同时写出分块已全部完成的文件，直到队列中没有任何未完成的工作
+    队列操作都在队列自己的线程中执行，等待数据库锁时不阻塞进行中的请求和续约
+    领取的分块数不超过并发数（批量模式下为并发数乘以每批分块数）；其他进程持有的租约未过期时每隔 worker_poll_seconds 秒查看一次
+    """
+    config = ctx.config
+    scheduler = ChunkScheduler(config.max_concurrency)
+    if config.batch_max_chunks > 1:
+        scheduler.batcher = ChunkBatcher(ctx, scheduler, config.batch_max_chunks, chunk_token_budget(ctx), config.batch_chunk_tokens, config.batch_wait)
+    limit = config.max_concurrency * max(1, config.batch_max_chunks)
+    active = set()
+    while True:
+        job = await queue.run(queue.claim_file, worker)
+        while job is not None:
+            try:
+                await write_file(ctx, queue, job, worker)
+            except (OSError, sqlite3.Error) as e:
+                # 文件保持写出中状态，租约过期后由其他进程（或本进程）重新写出
+                ctx.logger.error(f"写出文件失败：{job.output_path}，{e!r}")
+            job = await queue.run(queue.claim_file, worker)
+        while len(active) < limit:
+            unit = await queue.run(queue.claim, worker)
+            if unit is None:
+                break
+            active.add(asyncio.ensure_future(process_unit(ctx, queue, scheduler, worker, unit)))
+        if active:
+            done, active = await asyncio.wait(active, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    # 分块保持领取状态，租约过期后由其他进程（或本进程）重新处理
+                    ctx.logger.error(f"处理分块失败：{task.exception()!r}")
+        elif await queue.run(queue.is_drained):
+            break
+        else:
+            await asyncio.sleep(config.worker_poll_seconds)
+
+
+def queue_summary(queue: WorkQueue) -> Dict[str, int]:
+    stats = queue.stats()
+    return {"files_done": stats.get("files_done", 0), "files_failed": stats.get("files_failed", 0),
+            "files_pending": stats.get("files_pending", 0) + stats.get("files_assembling", 0),
+            "units_pending": stats.get("units_pending", 0) + stats.get("units_leased", 0)}
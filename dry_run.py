@@ -0,0 +1,134 @@
+import os
+from typing import Dict, Iterator, List, Tuple
+from config import Config
+from init_project import AppContext
+from chunk_cache import ChunkCache
+from chunker import split_into_chunk_spans
+from check_comment import filter_space_and_comment
+from file_process import SYSTEM_PROMPT, PROMPT_TEMPLATE, PROMPT_VERSION, lookup_comment, plan_partial_runs
+from resume_index import ResumeIndex
+
+
+class FileEstimate:
+    """单个文件的预估：需要调用 API 的分块数与 token 数，以及由 table、分块缓存直接得到结果的分块数"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.start_line = 0
+        self.chunks = 0
+        self.table_hits = 0
+        self.cache_hits = 0
+        self.partial_hits = 0  # 只为没有注释的部分调用API的分块数
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.seconds = 0.0  # 各次调用的耗时之和（未考虑并发）
+
+    def to_dict(self) -> Dict:
+        return {"start_line": self.start_line, "chunks": self.chunks, "table_hits": self.table_hits,
+                "cache_hits": self.cache_hits, "partial_hits": self.partial_hits, "calls": self.calls, "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens}
+
+
+def resume_line(file_path: str, comment_path: str, content: List[str]) -> int:
+    """
+    按断点索引得到实际运行时开始处理的行：最后一条记录与源码一致时从该处继续，否则从头处理
+    （源码被修改过时实际运行可能只按 diff 重新注释改动部分，这里按整体重新注释估算，结果偏保守）
+    """
+    if not os.path.isfile(comment_path):
+        return 0
+    code_type = os.path.splitext(file_path)[1].lower()
+    resume_index = ResumeIndex(comment_path)
+    records = resume_index.load()
+    record = resume_index.find_resume_point(content, code_type)
+    if record is not None and record == records[-1]:
+        return record.line
+    return 0
+
+
+def estimate_file(ctx: AppContext, file_path: str, comment_path: str, content: List[str], budget: int) -> FileEstimate:
+    """按 split_file_and_process 的方式切分文件，扣除 table 和分块缓存能直接给出结果的分块，估算 API 调用"""
+    config, token_counter = ctx.config, ctx.token_counter
+    estimate = FileEstimate(file_path)
+    code_type = os.path.splitext(file_path)[1].lower()
+    start_line = estimate.start_line = resume_line(file_path, comment_path, content)
+    spans = [(start_line + start, start_line + end)
+             for start, end in split_into_chunk_spans(content[start_line:], code_type, token_counter, budget)]
+    for start, end in spans:
+        chunk_lines = content[start:end]
+        chunk = "".join(line + "\n" for line in chunk_lines)
+        estimate.chunks += 1
+        # 与 FileProcess.load_from_table 一致：先逐行查 table（含规范化索引），再按规范化后的整块代码查分块缓存
+        found = [line.strip() == "" or lookup_comment(ctx, line, code_type)[0] is not None for line in chunk_lines]
+        if all(found):
+            estimate.table_hits += 1
+            continue
+        key = ChunkCache.make_key(filter_space_and_comment(chunk, code_type), code_type, config.model, PROMPT_VERSION)
+        if ctx.chunk_cache.get(key) is not None:
+            estimate.cache_hits += 1
+            continue
+        # 大部分代码行已有注释时只为没有注释的部分调用API
+        runs = plan_partial_runs(config, chunk_lines, found, token_counter)
+        if runs:
+            estimate.partial_hits += 1
+            for run_start, run_end in runs:
+                add_call(config, token_counter, estimate, file_path, "\n".join(chunk_lines[run_start:run_end]))
+        else:
+            add_call(config, token_counter, estimate, file_path, chunk)
+    return estimate
+
+
+def add_call(config: Config, token_counter, estimate: FileEstimate, file_path: str, content: str) -> None:
+    """按分块内容估算一次API调用的 token 数和耗时"""
+    prompt_tokens = token_counter(SYSTEM_PROMPT + PROMPT_TEMPLATE.format(file_path=file_path, content=content))
+    # 输出包含代码本身和新增注释，与计算分块预算时的假设一致
+    completion_tokens = int(token_counter(content) * (1 + config.comment_ratio))
+    estimate.calls += 1
+    estimate.prompt_tokens += prompt_tokens
+    estimate.completion_tokens += completion_tokens
+    estimate.seconds += config.estimate_call_seconds + completion_tokens / config.estimate_output_tokens_per_second
+
+
+def estimate_wall_seconds(config: Config, calls: int, tokens: int, call_seconds: float) -> float:
+    """按并发数和每分钟请求、token 上限估算总耗时，取三者中最慢的一个"""
+    seconds = call_seconds / max(1, config.max_concurrency)
+    if config.requests_per_minute > 0:
+        seconds = max(seconds, calls * 60 / config.requests_per_minute)
+    if config.tokens_per_minute > 0:
+        seconds = max(seconds, tokens * 60 / config.tokens_per_minute)
+    return seconds
+
+
+def dry_run(ctx: AppContext, files: Iterator[Tuple[str, List[str]]], budget: int) -> Dict:
+    """
+    不调用 API，估算处理 files 需要的调用次数、token 数、费用和耗时
+    files 与实际运行相同（遍历时已跳过指纹清单中未变化的文件），规范化内容未变化的文件同样跳过
+    """
+    manifest = ctx.manifest
+    estimates = []
+    for file_path, content in files:
+        comment_path = ctx.output_path_for(file_path)
+        code_type = os.path.splitext(file_path)[1].lower()
+        if manifest.is_same_content(file_path, comment_path, content, code_type):
+            manifest.skipped += 1
+            continue
+        estimates.append(estimate_file(ctx, file_path, comment_path, content, budget))
+    chunks = sum(e.chunks for e in estimates)
+    calls = sum(e.calls for e in estimates)
+    prompt_tokens = sum(e.prompt_tokens for e in estimates)
+    completion_tokens = sum(e.completion_tokens for e in estimates)
+    return {
+        "files": len(estimates),
+        "skipped_files": manifest.skipped,
+        "chunks": chunks,
+        "table_hits": sum(e.table_hits for e in estimates),
+        "cache_hits": sum(e.cache_hits for e in estimates),
+        "partial_hits": sum(e.partial_hits for e in estimates),
+        "calls": calls,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost": round(ctx.token_usage.cost(prompt_tokens, completion_tokens), 6),
+        "wall_seconds": round(estimate_wall_seconds(ctx.config, calls, prompt_tokens + completion_tokens,
+                                                    sum(e.seconds for e in estimates)), 1),
+        "by_file": {e.file_path: e.to_dict() for e in estimates if e.calls},
+    }
@@ -1,10 +1,15 @@
+import codecs
 import os
-import chardet  # 需安装：pip install chardet
+import sqlite3
+import threading
+from chardet import UniversalDetector  # 需安装：pip install chardet
+
+DETECT_BLOCK_SIZE = 64 * 1024  # 增量检测每次送入的字节数
 
 
 def detect_file_encoding(file_path: str, sample_size: int = 1024 * 1024) -> str:
     """
-    检测文本文件的编码方式（基于chardet，支持更多编码且准确性更高）
+    检测文本文件的编码方式（先尝试严格 UTF-8 解码，失败时再用chardet增量检测，支持更多编码且准确性更高）
     
     参数:
         file_path: 文本文件路径
@@ -53,12 +58,25 @@ def detect_file_encoding(file_path: str, sample_size: int = 1024 * 1024) -> str:
     if sample.startswith(b'\x00\x00\xfe\xff'):
         return 'utf-32be'
     
-    # 4. 使用chardet检测编码（支持更多编码类型）
+    # 4. 快速路径：能按 UTF-8（含纯 ASCII）严格解码的直接返回，绝大多数源码文件和本工具写出的输出文件都在此返回
+    #    样本可能截断在多字节字符中间，未读完整个文件时不要求样本末尾完整
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=len(sample) < sample_size)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    # 5. 使用chardet的增量检测器（支持更多编码类型），置信度足够时提前结束，不必分析整个样本
     try:
-        # 检测样本的编码，返回字典（包含'encoding'和'confidence'等键）
-        detection_result = chardet.detect(sample)
+        detector = UniversalDetector()
+        for start in range(0, len(sample), DETECT_BLOCK_SIZE):
+            detector.feed(sample[start:start + DETECT_BLOCK_SIZE])
+            if detector.done:
+                break
+        detector.close()
+        detection_result = detector.result
         encoding = detection_result.get('encoding')
-        confidence = detection_result.get('confidence', 0.0)
+        confidence = detection_result.get('confidence') or 0.0
         
         # 过滤低置信度结果（置信度低于0.5的编码可靠性差）
         if encoding and confidence >= 0.5:
@@ -79,6 +97,70 @@ def detect_file_encoding(file_path: str, sample_size: int = 1024 * 1024) -> str:
         return "unknown"
 
 
+class EncodingCache:
+    """
+    编码检测结果的磁盘缓存（SQLite），键为 (文件绝对路径, 大小, 修改时间)，文件未变化时不再读取和检测
+
+    读取文件的线程池会并发调用 detect，连接跨线程共享并加锁；新结果批量提交
+    """
+
+    COMMIT_EVERY = 256
+
+    def __init__(self, db_path: str = "encoding_cache.db"):
+        self.db_path = db_path
+        dir_path = os.path.dirname(db_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS encodings (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime INTEGER NOT NULL, encoding TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self.hits = 0
+        self.misses = 0
+
+    def detect(self, file_path: str) -> str:
+        """返回文件编码，缓存命中时只需一次 stat"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return detect_file_encoding(file_path)
+        path = os.path.abspath(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT encoding FROM encodings WHERE path = ? AND size = ? AND mtime = ?",
+                (path, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row is not None:
+            self.hits += 1
+            return row[0]
+        self.misses += 1
+        encoding = detect_file_encoding(file_path)
+        if encoding != "unknown":
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO encodings (path, size, mtime, encoding) VALUES (?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime_ns, encoding)
+                )
+                self._uncommitted += 1
+                if self._uncommitted >= self.COMMIT_EVERY:
+                    self._conn.commit()
+                    self._uncommitted = 0
+        return encoding
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+
 # 使用示例
 # if __name__ == "__main__":
 #     test_files = [
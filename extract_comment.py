@@ -1,15 +1,16 @@
 import re
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
 
-def extract_code_blocks(text: str) -> List[str]:
+def extract_code_blocks(text: str, with_lang: bool = False) -> Union[List[str], List[Tuple[str, str]]]:
     """
     提取字符串中被 ``` 嵌套的代码块内容
     
     参数:
         text: 包含 ``` 代码块的原始字符串
+        with_lang: 是否同时返回代码块开头 ``` 之后的标识（语言及批量请求中的 id=编号 等）
         
     返回:
-        提取到的代码块列表（不含 ``` 标记和语言标识）
+        提取到的代码块列表（不含 ``` 标记和语言标识）；with_lang 为 True 时为 (标识, 代码块内容) 列表
     """
     # 正则表达式说明：
     # - ```(.*?) 匹配起始的 ``` 及可能的语言标识（非贪婪匹配）
@@ -24,7 +25,7 @@ def extract_code_blocks(text: str) -> List[str]:
         # 去除内容前后的空行和空白字符
         cleaned_content = content.strip()
         if cleaned_content:  # 只保留非空内容
-            code_blocks.append(cleaned_content)
+            code_blocks.append((lang.strip(), cleaned_content) if with_lang else cleaned_content)
     
     return code_blocks
 
@@ -1,16 +1,147 @@
 import os
 import logging
-from typing import List, Dict
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 from config import Config
-from encoding_detector import detect_file_encoding  # 导入编码检测函数
 from filter_comment import filter_comment_from_code  # 导入注释过滤函数
-from init_project import logger, config
+from encoding_detector import EncodingCache, detect_file_encoding
+from metrics import metrics
 
-def read_files_by_extensions(path: str, filter_comment: bool = True) -> Dict[str, List[str]]:
+# 日志处理器由 init_project.setup_logger 配置
+logger = logging.getLogger("FileReader")
+
+def iter_source_paths(path: str, extensions: Iterable[str], exclude: Optional[str] = None) -> Iterator[str]:
+    """
+    用 os.scandir 遍历路径（文件或文件夹），按遍历顺序逐个产出后缀在 extensions 中的文件路径
+
+    目录项的类型信息来自 scandir，不再逐个 stat；exclude 目录（如位于输入目录内的输出目录）整体跳过
+    每个目录的遍历耗时记入 scan 阶段（不含调用方处理产出文件的时间）
+    """
+    allowed_extensions = {ext.lower() for ext in extensions}
+    if os.path.isfile(path):
+        file_ext = os.path.splitext(path)[1].lower()
+        if file_ext in allowed_extensions:
+            yield path
+        else:
+            logger.error(f"文件 {path} 后缀不支持（{file_ext}），支持的后缀：{sorted(allowed_extensions)}")
+        return
+    excluded = os.path.abspath(exclude) if exclude else None
+    stack = [path]
+    while stack:
+        dir_path = stack.pop()
+        sub_dirs, files = [], []
+        with metrics.span("scan"):
+            try:
+                with os.scandir(dir_path) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as e:
+                logger.error(f"文件夹 {dir_path} 遍历失败：{str(e)}")
+                entries = []
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if excluded is None or os.path.abspath(entry.path) != excluded:
+                            sub_dirs.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in allowed_extensions:
+                        files.append(entry.path)
+                except OSError as e:
+                    logger.error(f"{entry.path} 访问失败：{str(e)}")
+        yield from files
+        # 子文件夹按名称顺序深度优先遍历
+        stack.extend(reversed(sub_dirs))
+
+def detect_encoding(path: str, encoding_cache: Optional[EncodingCache] = None) -> str:
+    """检测文件编码，传入 encoding_cache 时文件未变化则直接使用缓存的结果"""
+    return encoding_cache.detect(path) if encoding_cache is not None else detect_file_encoding(path)
+
+def read_source_file(path: str, filter_comment: bool = True, encoding_cache: Optional[EncodingCache] = None) -> Optional[List[str]]:
+    """读取单个文件（自动检测编码），返回按行分割的内容，失败时记录日志并返回 None"""
+    encoding = "unknown"
+    try:
+        # 自动检测文件编码（文件未变化时直接使用缓存的结果）
+        with metrics.span("encoding_detect"):
+            encoding = detect_encoding(path, encoding_cache)
+        if encoding == "unknown":
+            warning_msg = f"文件 {path} 编码未知，不进行读取"
+            logger.warning(warning_msg)  # 记录警告（非错误，但需要关注）
+
+        with metrics.span("read_file"), open(path, 'r', encoding=encoding, errors='replace') as f:
+            content = f.read()
+        metrics.inc("files_read_total")
+        metrics.inc("chars_read_total", len(content))
+        if filter_comment:
+            with metrics.span("filter_comment"):
+                content = filter_comment_from_code(content, os.path.splitext(path)[1].lower())
+        return content.split("\n")  # 以换行符分割为列表
+    except UnicodeDecodeError as e:
+        error_msg = f"文件 {path} 编码错误（{encoding}）：{str(e)}"
+        logger.error(error_msg)
+    except Exception as e:
+        error_msg = f"文件 {path} 读取失败：{str(e)}"
+        logger.error(error_msg)
+    return None
+
+def iter_files_by_extensions(config: Config, path: str, filter_comment: bool = True, exclude: Optional[str] = None,
+                             workers: Optional[int] = None, prefetch: Optional[int] = None,
+                             skip: Optional[Callable[[str], bool]] = None,
+                             encoding_cache: Optional[EncodingCache] = None) -> Iterator[Tuple[str, List[str]]]:
+    """
+    边遍历边读取，按遍历顺序逐个产出 (文件路径, 按行分割的内容)
+
+    读取、解码和过滤注释在 workers 个线程中进行，最多提前读取 prefetch 个文件，
+    调用方处理第一个文件时遍历仍在继续，内存占用与目录树大小无关；skip(文件路径) 为 True 的文件不读取
+    """
+    workers = workers or config.read_workers
+    prefetch = max(prefetch or workers * 2, 1)
+    pending: Deque[Tuple[str, "Future[Optional[List[str]]]"]] = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="file-reader") as executor:
+        try:
+            for file_path in iter_source_paths(path, config.text_extensions, exclude):
+                metrics.inc("files_scanned_total")
+                if skip is not None and skip(file_path):
+                    metrics.inc("files_skipped_total")
+                    continue
+                pending.append((file_path, executor.submit(read_source_file, file_path, filter_comment, encoding_cache)))
+                while len(pending) >= prefetch:
+                    file_path, future = pending.popleft()
+                    content = future.result()
+                    if content is not None:
+                        yield file_path, content
+            while pending:
+                file_path, future = pending.popleft()
+                content = future.result()
+                if content is not None:
+                    yield file_path, content
+        finally:
+            # 调用方提前结束迭代时，丢弃尚未开始的读取
+            for _, future in pending:
+                future.cancel()
+
+def atomic_write(path: str, text: str, encoding: str = "utf-8") -> None:
+    """先写入同目录下的临时文件并 fsync，再用 os.replace 替换目标文件，目标文件任何时刻都是完整的"""
+    dir_path = os.path.dirname(path) or "."
+    os.makedirs(dir_path, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=dir_path)
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def read_files_by_extensions(config: Config, path: str, filter_comment: bool = True,
+                             encoding_cache: Optional[EncodingCache] = None) -> Dict[str, List[str]]:
     """
     读取指定路径的内容（文件或文件夹），并将错误信息记录到日志
     
     参数:
+        config: 配置（文件后缀、读取线程数）
         path: 待读取的文件或文件夹路径
         fliter_comment: 是否过滤掉注释行
     
@@ -31,66 +162,9 @@ def read_files_by_extensions(path: str, filter_comment: bool = True) -> Dict[str
         return {"error": error_msg}
     
     # 存储结果：{文件路径: 内容}
-    result = {}
-    
-    # 1. 如果是文件，直接读取（需符合后缀要求）
-    if os.path.isfile(path):
-        # 获取文件后缀（如 ".txt"）
-        file_ext = os.path.splitext(path)[1].lower()
-        # 检查后缀是否在配置的 text_extensions 中（忽略大小写）
-        allowed_extensions = [ext.lower() for ext in config.text_extensions]
-        
-        if file_ext in allowed_extensions:
-            try:
-                # 自动检测文件编码
-                encoding = detect_file_encoding(path)
-                if encoding == "unknown":
-                    warning_msg = f"文件 {path} 编码未知，不进行读取"
-                    logger.warning(warning_msg)  # 记录警告（非错误，但需要关注）
-                
-                with open(path, 'r', encoding=encoding, errors='replace') as f:
-                    content = f.read()
-                    if filter_comment:
-                        content = filter_comment_from_code(content, file_ext)
-                result[path] = content.split("\n")  # 以换行符分割为列表
-                
-            except UnicodeDecodeError as e:
-                error_msg = f"文件 {path} 编码错误（{encoding}）：{str(e)}"
-                logger.error(error_msg)
-            except Exception as e:
-                error_msg = f"文件 {path} 读取失败：{str(e)}"
-                logger.error(error_msg)
-        else:
-            error_msg = f"文件 {path} 后缀不支持（{file_ext}），支持的后缀：{config.text_extensions}"
-            logger.error(error_msg)
-        
-        return result
-    
-    # 2. 如果是文件夹，递归读取所有符合条件的文件
-    elif os.path.isdir(path):
-        try:
-            # 遍历文件夹中的所有项
-            for item in os.listdir(path):
-                item_path = os.path.join(path, item)
-                # 递归处理子文件夹或文件
-                sub_result = read_files_by_extensions(item_path, filter_comment)
-                # 合并结果（跳过错误信息，只保留文件内容）
-                for key, value in sub_result.items():
-                    if key != "error":
-                        result[key] = value
-        except Exception as e:
-            error_msg = f"文件夹 {path} 遍历失败：{str(e)}"
-            logger.error(error_msg)
-        
-        return result
-    
-    # 3. 既不是文件也不是文件夹（如特殊设备文件）
-    else:
-        error_msg = f"不支持的路径类型: {path}"
-        logger.error(error_msg)
-        return {}
+    return dict(iter_files_by_extensions(config, path, filter_comment, encoding_cache=encoding_cache))
 
-def read_files(path: str, filter_comment: bool = True) -> Dict[str, List[str]]:
+def read_files(path: str, filter_comment: bool = True, encoding_cache: Optional[EncodingCache] = None) -> Dict[str, List[str]]:
     """
     读取指定路径的内容（文件或文件夹），并将错误信息记录到日志
     
@@ -116,8 +190,8 @@ def read_files(path: str, filter_comment: bool = True) -> Dict[str, List[str]]:
     # 1. 如果是文件，直接读取（需符合后缀要求）
     if os.path.isfile(path):
         try:
-            # 自动检测文件编码
-            encoding = detect_file_encoding(path)
+            # 自动检测文件编码（文件未变化时直接使用缓存的结果）
+            encoding = detect_encoding(path, encoding_cache)
             if encoding == "unknown":
                 warning_msg = f"文件 {path} 编码未知，不进行读取"
                 logger.warning(warning_msg)  # 记录警告（非错误，但需要关注）
@@ -140,7 +214,7 @@ def read_files(path: str, filter_comment: bool = True) -> Dict[str, List[str]]:
             for item in os.listdir(path):
                 item_path = os.path.join(path, item)
                 # 递归处理子文件夹或文件
-                sub_result = read_files(item_path, filter_comment)
+                sub_result = read_files(item_path, filter_comment, encoding_cache)
                 # 合并结果（跳过错误信息，只保留文件内容）
                 for key, value in sub_result.items():
                     if key != "error":
@@ -1,11 +1,78 @@
 import os
+import asyncio
 from api import call_llm_api
-from typing import Dict, Optional, Any, List
-from init_project import config, logger, table, params
+from typing import Dict, Optional, Any, List, Tuple
+from init_project import AppContext
+from config import Config
+from chunk_cache import ChunkCache
+from chunker import compute_chunk_budget
+from cpu_pool import analyze_generated, collect_unmatched_comments
+from stream_validator import StreamValidator, ABORT_TRUNCATED
+from rate_limiter import backoff_delay
 from filter_comment import filter_comment_from_code
-from check_comment import filter_space_and_comment, check_code_with_content, minDistance
-from json_dict import save_dict_to_json
+from check_comment import filter_space_and_comment, check_code_with_content, minDistance, reapply_chunk, reapply_comment
 from extract_comment import extract_code_blocks
+from metrics import metrics
+
+SYSTEM_PROMPT = "你是一个优秀的软件工程师，能够准确、合理地为代码片段添加逐行详细中文注释（注意：注释写在代码同行，只添加注释不修改任何代码、缩进与代码格式，不删除、添加注释之外的任何内容，确保删除注释后和源代码每行都相同）。记住：无论代码对错，你都不可以修改任何代码内容，只能添加注释"
+PROMPT_TEMPLATE = "路径:{file_path}的文件中包含如下代码片段：\n{content}\n请给出逐行详细注释后的代码，只给出带有注释的代码即可，不要修改或删除代码片段的任何内容（因为是代码片段，所以可能有多余的括号，请不要删除多余的括号，也不要补充缺少的括号，确保删除注释后和源代码每行都相同），输出格式：```语言\n注释过的代码\n```。"
+# 修改提示词后需要递增版本号，使分块缓存中旧提示词生成的结果失效
+PROMPT_VERSION = "1"
+
+def chunk_token_budget(ctx: AppContext) -> int:
+    """按配置计算单个分块的代码token预算（为注释预留输出空间，并扣除提示词开销）"""
+    config = ctx.config
+    prompt_overhead = ctx.token_counter(SYSTEM_PROMPT + PROMPT_TEMPLATE)
+    return compute_chunk_budget(config.max_tokens, config.context_window, config.chunk_target_ratio, config.comment_ratio, prompt_overhead)
+
+def lookup_comment(ctx: AppContext, line: str, code_type: str) -> Tuple[Optional[str], bool]:
+    """
+    查找代码行的注释：先按原始代码行精确查找，再按规范化代码查找并套用到当前行（保留当前行的缩进和代码文本）
+    返回 (注释行, 是否来自规范化索引)，都找不到时注释行为 None
+    """
+    comment = ctx.table.get(line)
+    if comment is not None or not ctx.config.table_fuzzy:
+        return comment, False
+    stored = ctx.table.find_normalized(line, code_type)
+    if stored is None:
+        return None, False
+    comment = reapply_comment(line, stored, code_type)
+    # 套用后去掉注释须与当前行一致（例如注释语法不同的语言写入的同一行代码不复用）
+    if filter_space_and_comment(comment, code_type) != filter_space_and_comment(line, code_type):
+        return None, False
+    return comment, True
+
+def remember_comment(ctx: AppContext, line: str, comment: str, code_type: str) -> None:
+    """把生成的注释行记入 table，同时按规范化代码记录，供缩进或空白不同的同一行代码复用"""
+    ctx.table[line] = comment
+    if ctx.config.table_fuzzy:
+        ctx.table.record_normalized(line, comment, code_type)
+
+def plan_partial_runs(config: Config, lines: List[str], found: List[bool], token_counter) -> Optional[List[Tuple[int, int]]]:
+    """
+    部分复用：分块中已有注释的代码行不少于 partial_reuse_min_ratio 时，把没有注释的连续行（前后各带 partial_context_lines 行上下文）
+    划分为若干段 [start, end)，只有这些段需要调用API。每次调用都有提示词开销，因此间隔的 token 少于该开销的相邻段合并为一段，
+    按估算的 token 数（输入代码和提示词，输出代码和注释）不比整块调用更少时返回 None
+    """
+    code_found = [ok for line, ok in zip(lines, found) if line.strip()!=""]
+    if not config.partial_reuse or not code_found or all(code_found) or sum(code_found) < len(code_found) * config.partial_reuse_min_ratio:
+        return None
+    overhead = token_counter(SYSTEM_PROMPT + PROMPT_TEMPLATE)
+    def cost(start: int, end: int) -> float:
+        return token_counter("\n".join(lines[start:end])) * (2 + config.comment_ratio)
+    context = config.partial_context_lines
+    runs = []
+    for i, ok in enumerate(found):
+        if ok:
+            continue
+        start, end = max(0, i - context), min(len(found), i + 1 + context)
+        if runs and (start <= runs[-1][1] or cost(runs[-1][1], start) < overhead):
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+    if sum(overhead + cost(start, end) for start, end in runs) >= overhead + cost(0, len(lines)):
+        return None
+    return runs
 
 class FileProcess:
     file_path: str
@@ -16,133 +83,246 @@ class FileProcess:
     generate_lines: List[str]
     unfind_lines: List[str]
 
-    def __init__(self, file_path: str, content: str):
+    def __init__(self, ctx: AppContext, file_path: str, content: str):
+        self.ctx = ctx
         self.file_path = file_path
         self.lines = content.split("\n")
         self.content = content
-        self.output_file_path = os.path.join(params['output'], os.path.relpath(file_path, params['input'])) if params["input"]!=file_path else os.path.join(params['output'], os.path.basename(file_path))
+        self.output_file_path = ctx.output_path_for(file_path)
+        self._validated = None  # (校验过的 generate_content, 校验结果)
+        self.fuzzy_lines = 0  # 从 table 得到完整结果时，其中按规范化代码复用注释的行数
+        self.found_lines: List[bool] = []  # 每行是否在 table 中找到注释（空行视为找到）
+        self.load_from_table()
+        print(f"初始化时未能从table中找到以下代码的注释：{self.unfind_lines}")
+
+    def load_from_table(self) -> None:
+        """从table中查找每行代码的注释（原始代码行找不到时按规范化代码查找），全部找到时直接作为生成结果"""
         generate_content = ""
         self.unfind_lines = []
+        fuzzy_lines = 0
+        self.found_lines = []
         for line in self.lines:
             if line.strip()!="":
-                if line not in table:
+                comment, fuzzy = lookup_comment(self.ctx, line, self.code_type)
+                if comment is None:
                     self.unfind_lines.append(line)
                 else:
-                    generate_content+=table[line]+"\n"
+                    generate_content+=comment+"\n"
+                    fuzzy_lines += fuzzy
+                self.found_lines.append(comment is not None)
             else:
                 generate_content+=line+"\n"
+                self.found_lines.append(True)
         self.generate_content = generate_content if self.unfind_lines==[] else ""
+        self.fuzzy_lines = fuzzy_lines if self.unfind_lines==[] else 0
+        if self.unfind_lines!=[]:
+            # 逐行未命中时，再按去掉空白和注释后的整块代码查分块缓存
+            cached = self.ctx.chunk_cache.get(self.cache_key())
+            if cached is not None:
+                reapplied = reapply_chunk(self.content, cached, self.code_type)
+                if reapplied is not None:
+                    self.generate_content = reapplied
+                    self.unfind_lines = []
         self.generate_lines = self.generate_content.split("\n")
-        print(f"初始化时未能从table中找到以下代码的注释：{self.unfind_lines}")
 
-    async def api_retry_and_update_table(self, retry_times: int = 3) -> None:
+    @property
+    def code_type(self) -> str:
+        return os.path.splitext(self.file_path)[1].lower()
+
+    def cache_key(self) -> str:
+        """分块缓存的键：模型、提示词版本和规范化后的代码"""
+        return ChunkCache.make_key(filter_space_and_comment(self.content, self.code_type), self.code_type, self.ctx.config.model, PROMPT_VERSION)
+
+    @metrics.timed("api_retry_and_update_table")
+    async def api_retry_and_update_table(self, retry_times: Optional[int] = None) -> None:
         """
         带重试地调用API，获取生成的注释，并更新generate_content、generate_lines、table、unfind_lines
+        限流、服务端错误等可重试的失败会按指数退避（含抖动，遵循 Retry-After）等待后再重试
         """
+        if retry_times is None:
+            retry_times = self.ctx.config.retry_times
         code_type = os.path.splitext(self.file_path)[1].lower()
-        prompt = f"路径:{self.file_path}的文件中包含如下代码片段：\n{self.content}\n请给出逐行详细注释后的代码，只给出带有注释的代码即可，不要修改或删除代码片段的任何内容（因为是代码片段，所以可能有多余的括号，请不要删除多余的括号，也不要补充缺少的括号，确保删除注释后和源代码每行都相同），输出格式：```语言\n注释过的代码\n```。"
+        prompt = PROMPT_TEMPLATE.format(file_path=self.file_path, content=self.content)
         for iii in range(retry_times):
             print(f"\n第{iii+1}次尝试调用API...")
-            result = await call_llm_api(config, prompt, system_prompt="你是一个优秀的软件工程师，能够准确、合理地为代码片段添加逐行详细中文注释（注意：注释写在代码同行，只添加注释不修改任何代码、缩进与代码格式，不删除、添加注释之外的任何内容，确保删除注释后和源代码每行都相同）。记住：无论代码对错，你都不可以修改任何代码内容，只能添加注释")
+            # 流式模式下边接收边校验，输出偏离源码或将被截断时提前中止
+            validator = StreamValidator(self.content, code_type, self.ctx.config.max_tokens, self.ctx.token_counter) if self.ctx.config.stream else None
+            result = await call_llm_api(self.ctx.config, prompt, system_prompt=SYSTEM_PROMPT, limiter=self.ctx.limiter,
+                                        stream=self.ctx.config.stream, on_delta=validator.feed if validator else None)
+            self.ctx.token_usage.record_result(self.file_path, iii+1, result, SYSTEM_PROMPT+prompt, self.ctx.token_counter)
+            if result.get("abort_reason")==ABORT_TRUNCATED:
+                print(f"流式输出预计被截断，拆分代码片段后重试")
+                self.ctx.logger.error(f"file_path:{self.file_path},流式输出预计被截断，拆分代码片段后重试")
+                await self.split_and_retry()
+                return
             if result.get("success"):
                 result["generated_content"] = extract_code_blocks(result["generated_content"])
                 if len(result["generated_content"])!=1:
                     print(f"API调用成功，但API返回的代码块数量不为1，请检查API返回内容")
-                    logger.error(f"API调用成功，但API返回的代码块数量不为1，请检查API返回内容")
+                    self.ctx.logger.error(f"API调用成功，但API返回的代码块数量不为1，请检查API返回内容")
                     ################输出内容被截断
-                    self.generate_content = ""
-                    self.generate_lines = []
-                    self.unfind_lines = []
-                    file_process=FileProcess(self.file_path, "\n".join(self.lines[:len(self.lines)//2]))
-                    await file_process.api_retry_and_update_table()
-                    self.generate_content += file_process.generate_content+"\n"
-                    self.generate_lines.extend(file_process.generate_lines)
-                    self.unfind_lines.extend(file_process.unfind_lines)
-                    file_process=FileProcess(self.file_path, "\n".join(self.lines[len(self.lines)//2:]))
-                    await file_process.api_retry_and_update_table()
-                    self.generate_content += file_process.generate_content
-                    self.generate_lines.extend(file_process.generate_lines)
-                    self.unfind_lines.extend(file_process.unfind_lines)
+                    await self.split_and_retry()
                     return
-                self.generate_content = result["generated_content"][0]
-                self.generate_lines = self.generate_content.split("\n")
-                self.unfind_lines = []
-                generate_content = ""
-                for line in self.lines:
-                    if line.strip()=="":
-                        continue
-                    i=0
-                    while i<len(self.generate_lines):
-                        if check_code_with_content(line, self.generate_lines[i], code_type):
-                            table[line]=self.generate_lines[i]
-                            generate_content+=self.generate_lines[i]+"\n"
-                            break
-                        i+=1
-                    if i==len(self.generate_lines):
-                        # print(f"未找到{line}对应的注释")
-                        logger.error(f"file_path:{self.file_path},未找到{line}对应的注释")
-                        self.unfind_lines.append(line)
-                        generate_content+=line+"\n"
-                
-                if self.unfind_lines==[]:    
-                    print("\n注释已全部生成完毕！")
-                    self.generate_content = generate_content
-                    self.generate_lines = self.generate_content.split("\n")
-                    break
-                elif check_code_with_content(self.generate_content, self.content, code_type):
-                    print("\n注释正确！")
-                    for line in self.unfind_lines:
-                        table[line]=""
-                        for generate_line in self.generate_lines:
-                            if filter_space_and_comment(generate_line, code_type) in filter_space_and_comment(line, code_type):
-                                table[line]=table[line]+generate_line
-                                if check_code_with_content(line, table[line], code_type):
-                                    break
-                    self.unfind_lines = []
+                if await self.apply_generated(result["generated_content"][0]):
                     break
-                else:
-                    print("\n未能找到以下注释：", self.unfind_lines)
-                    logger.error(f"file_path:{self.file_path},未能找到以下注释：{self.unfind_lines}")
-                    self.generate_content = generate_content
-                    self.generate_lines = self.generate_content.split("\n")
-                    if check_code_with_content(self.generate_content, self.content, code_type):
-                        break
-                    # minDistance(filter_space_and_comment(self.generate_content, code_type), filter_space_and_comment(self.content, code_type))
 
             if result.get("error"):
                 print("\nAPI调用失败：")
                 print("错误信息：", result["error"])
-                logger.error(f"API调用失败，错误信息：{result['error']}")
+                self.ctx.logger.error(f"API调用失败，错误信息：{result['error']}")
                 if "detail" in result:
-                    logger.error(f"API调用失败，详细信息：{result['detail']}")
+                    self.ctx.logger.error(f"API调用失败，详细信息：{result['detail']}")
                     print("详细信息：", result["detail"])
+                if result.get("retryable") and iii+1<retry_times:
+                    delay = backoff_delay(iii, self.ctx.config.backoff_base, self.ctx.config.backoff_max, result.get("retry_after"))
+                    print(f"{delay:.1f}秒后重试")
+                    await asyncio.sleep(delay)
 
-    async def output(self) -> bool:
-        code_type = os.path.splitext(self.file_path)[1].lower()
-        if check_code_with_content(self.content, self.generate_content, code_type):
-            os.makedirs(os.path.dirname(self.output_file_path), exist_ok=True)
-            with open(self.output_file_path, "a", encoding="utf-8") as f:
-                f.write(self.generate_content+"\n")
-                return True
+    async def apply_generated(self, generated: str) -> bool:
+        """
+        按模型返回的一个代码块更新generate_content、generate_lines、table、unfind_lines
+        返回是否得到了可用的结果（不必再重试）
+        """
+        code_type = self.code_type
+        self.generate_content = generated
+        self.generate_lines = self.generate_content.split("\n")
+        self.unfind_lines = []
+        generate_content = ""
+        # 源码行与生成行按顺序一次性对齐，每条生成行只规范化一次；对齐和校验在进程池中进行
+        with metrics.span("align"):
+            mapping, generated_valid = await self.ctx.cpu_pool.run(len(generated), analyze_generated, self.content, generated, code_type)
+        for line, index in zip(self.lines, mapping):
+            if line.strip()=="":
+                continue
+            if index is not None:
+                remember_comment(self.ctx, line, self.generate_lines[index], code_type)
+                generate_content+=self.generate_lines[index]+"\n"
+            else:
+                # print(f"未找到{line}对应的注释")
+                self.ctx.logger.error(f"file_path:{self.file_path},未找到{line}对应的注释")
+                self.unfind_lines.append(line)
+                generate_content+=line+"\n"
+        
+        if self.unfind_lines==[]:    
+            print("\n注释已全部生成完毕！")
+            self.generate_content = generate_content
+            self.generate_lines = self.generate_content.split("\n")
+            return True
+        elif generated_valid:
+            print("\n注释正确！")
+            comments = await self.ctx.cpu_pool.run(len(generated), collect_unmatched_comments, self.unfind_lines, generated, code_type)
+            for line, comment in zip(self.unfind_lines, comments):
+                remember_comment(self.ctx, line, comment, code_type)
+            self.unfind_lines = []
+            return True
         else:
-            if self.unfind_lines!=[]:
-                print("\n未找到以下代码的注释：", self.unfind_lines)
-            # minDistance(filter_space_and_comment(self.generate_content, code_type), filter_space_and_comment(self.content, code_type))  
-            return False
+            print("\n未能找到以下注释：", self.unfind_lines)
+            self.ctx.logger.error(f"file_path:{self.file_path},未能找到以下注释：{self.unfind_lines}")
+            self.generate_content = generate_content
+            self.generate_lines = self.generate_content.split("\n")
+            # minDistance(filter_space_and_comment(self.generate_content, code_type), filter_space_and_comment(self.content, code_type))
+            return await self.validate()
+
+    async def split_and_retry(self) -> None:
+        """
+        输出被截断时，把代码片段对半拆开分别调用API，再合并结果
+        非空行少于2行的片段不再拆分（拆分不会缩小问题，只会无限递归），保持原状由后续校验按生成失败处理
+        """
+        if sum(line.strip()!="" for line in self.lines)<2:
+            self.ctx.logger.error(f"file_path:{self.file_path},代码片段无法继续拆分，按生成失败处理")
+            return
+        self.generate_content = ""
+        self.generate_lines = []
+        self.unfind_lines = []
+        half = len(self.lines)//2
+        for part, tail in ((self.lines[:half], "\n"), (self.lines[half:], "")):
+            content = "\n".join(part)
+            if content.strip()=="":
+                # 只有空行的一半不需要注释，直接作为结果
+                self.generate_content += content+tail
+                self.generate_lines.extend(part)
+                continue
+            file_process=FileProcess(self.ctx, self.file_path, content)
+            await file_process.api_retry_and_update_table()
+            self.generate_content += file_process.generate_content+tail
+            self.generate_lines.extend(file_process.generate_lines)
+            self.unfind_lines.extend(file_process.unfind_lines)
+
+    async def validate(self) -> bool:
+        """生成的注释代码去掉注释后是否与源码一致（较大的分块在进程池中校验，同一生成结果只校验一次）"""
+        if self._validated is None or self._validated[0] is not self.generate_content:
+            valid = await self.ctx.cpu_pool.run(len(self.content), check_code_with_content, self.content, self.generate_content, self.code_type)
+            self._validated = (self.generate_content, valid)
+        return self._validated[1]
 
-    async def process(self) -> bool:
-        success = await self.output()
-        if not success:
-            await self.api_retry_and_update_table()
-            success = await self.output()
-            if not success:
-                print(f"{self.file_path}生成失败，将原文写入")
-                logger.error(f"{self.file_path}生成失败，将原文写入")
-                os.makedirs(os.path.dirname(self.output_file_path), exist_ok=True)
-                with open(self.output_file_path, "a", encoding="utf-8") as f:
-                    f.write(self.content+"\n")
-        success = success and save_dict_to_json(table, "table.json")
-        return success
+    def count_cache_hit(self) -> None:
+        """记录无需调用API的分块；用到了按规范化代码复用的注释时单独计数"""
+        if self.fuzzy_lines:
+            self.ctx.table.fuzzy_hits += self.fuzzy_lines
+            self.ctx.table.fuzzy_chunks += 1
+            metrics.inc("chunks_total", labels={"source": "table_fuzzy"})
+        else:
+            metrics.inc("chunks_total", labels={"source": "cache"})
 
+    async def generate_partial(self, batcher=None) -> bool:
+        """
+        部分复用：只为没有注释的若干段代码（带少量上下文）依次调用API，结果写入 table 后按行重新组装整个分块，
+        组装结果须与源码一致；不值得部分复用或有段生成失败时返回 False（由调用方整体生成）
+        """
+        runs = plan_partial_runs(self.ctx.config, self.lines, self.found_lines, self.ctx.token_counter)
+        if not runs:
+            return False
+        print(f"\n分块中{len(self.lines)-len(self.unfind_lines)}行已有注释，只为其中{len(runs)}段（共{sum(end-start for start, end in runs)}行）调用API")
+        for start, end in runs:
+            # 各段只是本分块的一部分：不单独计入分块指标，也不写入分块缓存
+            file_process = FileProcess(self.ctx, self.file_path, "\n".join(self.lines[start:end]))
+            if await file_process.resolve(batcher, partial=False) is None:
+                return False
+        self.load_from_table()
+        return self.unfind_lines==[] and await self.validate()
+
+    async def resolve(self, batcher=None, partial: bool = True) -> Optional[str]:
+        """
+        生成注释（不写文件，不记录分块指标，不写入分块缓存），table 中已有完整结果时不调用API
+        大部分代码行已有注释时（partial 为 True），只为没有注释的部分调用API
+        传入 batcher（ChunkBatcher）时，小分块先与其他小分块合并为一个请求，未得到可用结果时再单独调用API
+        返回结果的来源（cache、partial、batch、api），生成结果与源码不一致时返回 None
+        """
+        if await self.validate():
+            return "cache"
+        if self.unfind_lines!=[]:
+            # 排队期间其他分块可能已经补全了table
+            self.load_from_table()
+            if await self.validate():
+                return "cache"
+        if partial and await self.generate_partial(batcher):
+            return "partial"
+        if batcher is not None and batcher.accepts(self) and await batcher.generate(self) and await self.validate():
+            return "batch"
+        await self.api_retry_and_update_table()
+        if await self.validate():
+            return "api"
+        return None
 
+    async def generate(self, batcher=None, partial: bool = True) -> bool:
+        """生成一个分块的注释（见 resolve），记录分块指标，新生成的结果写入分块缓存；返回生成结果是否与源码一致"""
+        source = await self.resolve(batcher, partial)
+        if source == "cache":
+            self.count_cache_hit()
+            return True
+        if source is not None:
+            self.ctx.chunk_cache.put(self.cache_key(), self.generate_content)
+            metrics.inc("chunks_total", labels={"source": source})
+            return True
+        metrics.inc("chunks_total", labels={"source": "failed"})
+        if self.unfind_lines!=[]:
+            print("\n未找到以下代码的注释：", self.unfind_lines)
+        return False
 
+    def output_text(self, success: bool) -> str:
+        """该分块写入输出文件的内容：生成结果，生成失败时为原文"""
+        if success:
+            return self.generate_content+"\n"
+        print(f"{self.file_path}生成失败，将原文写入")
+        self.ctx.logger.error(f"{self.file_path}生成失败，将原文写入")
+        return self.content+"\n"
@@ -1,3 +1,10 @@
+import re
+from normalize_cache import normalization_cache
+
+
+_C_STYLE_TYPES = (".js", ".java", ".c", ".cpp", ".h", ".hpp", ".c++", "")
+
+
 def filter_comment_from_code(code: str, code_type: str) -> str:
     """
     过滤代码中的注释，支持多种编程语言
@@ -12,7 +19,7 @@ def filter_comment_from_code(code: str, code_type: str) -> str:
     # 根据文件类型选择对应的注释处理逻辑
     if code_type == ".py":
         return _filter_python_comment(code)
-    elif code_type in (".js", ".java", ".c", ".cpp", ".h", ".hpp", ".c++", ""):
+    elif code_type in _C_STYLE_TYPES:
         return _filter_c_style_comment(code)
     elif code_type == ".html":
         return _filter_html_comment(code)
@@ -21,115 +28,77 @@ def filter_comment_from_code(code: str, code_type: str) -> str:
         return code
 
 
+def comment_style(code_type: str) -> str:
+    """注释语法相同的后缀归为一类，同一类代码规范化的结果相同"""
+    if code_type == ".py":
+        return "python"
+    if code_type in _C_STYLE_TYPES:
+        return "c"
+    if code_type == ".html":
+        return "html"
+    return code_type
+
+
+def filter_space(content: str) -> str:
+    """去掉所有空白字符（空格、换行、制表符等）"""
+    return content.replace(" ", "").replace("\n", "").replace("\t", "").replace("\r", "").replace("\v", "").replace("\f", "")
+
+
+def filter_space_and_comment(content: str, code_type: str) -> str:
+    """去掉注释和所有空白字符，用于比较两段代码是否相同（结果按内容哈希缓存，同一段代码只规范化一次）"""
+    return normalization_cache.get_or_compute(content, code_type, _normalize)
+
+
+def _normalize(content: str, code_type: str) -> str:
+    return filter_space(filter_comment_from_code(content, code_type))
+
+
+# 各语言的词法规则：comment 组为注释，其余分支为字符串/字符字面量（原样保留，其中的 // # 等不是注释）
+# 整个文件用一个编译好的正则一次扫描完成，不再逐字符循环；不含注释起始符的文本（如已过滤过的代码行）直接返回
+_C_STYLE_PATTERN = re.compile(r'''
+    (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | R"(?P<delim>[^()\\\s]{0,16})\(.*?\)(?P=delim)"
+  | "(?:\\.|[^"\\\n])*"
+  | '(?:\\.|[^'\\\n])*'
+  | `(?:\\.|[^`\\])*`
+''', re.DOTALL | re.VERBOSE)
+
+_PYTHON_PATTERN = re.compile(r"""
+    (?P<comment>\#[^\n]*|\"\"\"(?:.*?\"\"\"|.*\Z)|'''(?:.*?'''|.*\Z))
+  | "(?:\\.|[^"\\\n])*"
+  | '(?:\\.|[^'\\\n])*'
+""", re.DOTALL | re.VERBOSE)
+
+_HTML_PATTERN = re.compile(r"(?P<comment><!--(?:.*?-->|.*\Z))", re.DOTALL)
+
+
+def _drop_comment(match: "re.Match[str]") -> str:
+    """注释替换为其中包含的换行（保持行号不变），字面量原样保留"""
+    comment = match.group("comment")
+    if comment is None:
+        return match.group(0)
+    return "\n" * comment.count("\n")
+
+
 def _filter_python_comment(code: str) -> str:
-    """过滤 Python 注释（# 单行注释、多行注释）"""
-    lines = code.split('\n')
-    result = []
-    in_multiline = False  # 是否在多行注释中
-    multiline_delim = None  # 多行注释分隔符（''' 或 """）
-    
-    for line in lines:
-        i = 0
-        n = len(line)
-        new_line = []
-        
-        while i < n:
-            if in_multiline:
-                # 查找多行注释结束符
-                if line.startswith(multiline_delim, i):
-                    in_multiline = False
-                    i += len(multiline_delim)
-                else:
-                    i += 1
-            else:
-                # 单行注释 #
-                if line.startswith('#', i):
-                    break  # 忽略 # 后的内容
-                # 多行注释开始（''' 或 """）
-                elif line.startswith('"""', i):
-                    in_multiline = True
-                    multiline_delim = '"""'
-                    i += 3
-                elif line.startswith("'''", i):
-                    in_multiline = True
-                    multiline_delim = "'''"
-                    i += 3
-                else:
-                    new_line.append(line[i])
-                    i += 1
-        
-        result.append(''.join(new_line))
-    
-    return '\n'.join(result)
+    """过滤 Python 注释（# 单行注释、三引号多行注释），字符串中的 # 不是注释"""
+    if "#" not in code and '"""' not in code and "'''" not in code:
+        return code
+    return _PYTHON_PATTERN.sub(_drop_comment, code)
 
 
 def _filter_c_style_comment(code: str) -> str:
-    """过滤 C 风格注释（// 单行注释、/* */ 多行注释），适用于 JS/Java/C/C++"""
-    lines = code.split('\n')
-    result = []
-    in_multiline = False  # 是否在 /* */ 多行注释中
-    
-    for line in lines:
-        i = 0
-        n = len(line)
-        new_line = []
-        
-        while i < n:
-            if in_multiline:
-                # 查找多行注释结束符 */
-                if i + 1 < n and line[i] == '*' and line[i+1] == '/':
-                    in_multiline = False
-                    i += 2  # 跳过 */
-                else:
-                    i += 1
-            else:
-                # 单行注释 //
-                if i + 1 < n and line[i] == '/' and line[i+1] == '/':
-                    break  # 忽略 // 后的内容
-                # 多行注释开始 /*
-                elif i + 1 < n and line[i] == '/' and line[i+1] == '*':
-                    in_multiline = True
-                    i += 2  # 跳过 /*
-                else:
-                    new_line.append(line[i])
-                    i += 1
-        
-        result.append(''.join(new_line))
-    
-    return '\n'.join(result)
+    """过滤 C 风格注释（// 单行注释、/* */ 多行注释），适用于 JS/Java/C/C++，字符串和字符字面量中的内容不是注释"""
+    if "//" not in code and "/*" not in code:
+        return code
+    return _C_STYLE_PATTERN.sub(_drop_comment, code)
 
 
 def _filter_html_comment(code: str) -> str:
     """过滤 HTML 注释（<!-- -->，支持跨多行）"""
-    lines = code.split('\n')
-    result = []
-    in_comment = False  # 是否在 <!-- --> 注释中
-    
-    for line in lines:
-        i = 0
-        n = len(line)
-        new_line = []
-        
-        while i < n:
-            if in_comment:
-                # 查找注释结束符 -->
-                if i + 2 < n and line[i] == '-' and line[i+1] == '-' and line[i+2] == '>':
-                    in_comment = False
-                    i += 3  # 跳过 -->
-                else:
-                    i += 1
-            else:
-                # 查找注释开始符 <!--
-                if i + 3 < n and line[i] == '<' and line[i+1] == '!' and line[i+2] == '-' and line[i+3] == '-':
-                    in_comment = True
-                    i += 4  # 跳过 <!--
-                else:
-                    new_line.append(line[i])
-                    i += 1
-        
-        result.append(''.join(new_line))
-    
-    return '\n'.join(result)
+    if "<!--" not in code:
+        return code
+    return _HTML_PATTERN.sub(_drop_comment, code)
 
 # # 测试 Python 注释过滤
 # py_code = """
@@ -1,6 +1,18 @@
 import os
+import threading
+from functools import wraps
+from typing import Callable, Dict, List, Optional, TypeVar
 from config import Config
-from json_dict import load_json_to_dict
+from table_store import TableStore
+from rate_limiter import AdaptiveRateLimiter
+from chunk_cache import ChunkCache
+from tokenizer import TokenCounter, get_token_counter
+from normalize_cache import normalization_cache
+from encoding_detector import EncodingCache
+from manifest import Manifest
+from token_usage import TokenUsage
+from cpu_pool import CpuPool
+from work_queue import WorkQueue
 import argparse
 import logging
 
@@ -39,9 +51,9 @@ def setup_logger():
     return logger
 
 
-def get_command_line_args():
+def get_command_line_args(argv: Optional[List[str]] = None) -> Dict:
     """
-    解析命令行参数，若参数不完整则提示用户补充输入
+    解析命令行参数（argv 为 None 时取 sys.argv），若参数不完整则提示用户补充输入
     返回完整的参数字典
     """
     # 1. 定义命令行参数解析器
@@ -51,11 +63,16 @@ def get_command_line_args():
     parser.add_argument("-o","--output", nargs='?', help="输出文件路径（必填）")
     # parser.add_argument("--mode", nargs='?', help="处理模式（可选，默认：normal）", default="normal")
     parser.add_argument("-v","--verbose", action="store_true", help="是否显示详细日志（可选）")
+    parser.add_argument("--since", nargs='?', help="只处理自该 git 版本以来有改动的文件（可选，如 HEAD~1）")
+    parser.add_argument("--dry-run", action="store_true", help="不调用API，只估算调用次数、token数、费用和耗时（可选）")
+    parser.add_argument("--coordinator", action="store_true", help="只把需要处理的文件切分后加入工作队列，由工作进程处理（可选）")
+    parser.add_argument("--worker", action="store_true", help="作为工作进程处理工作队列中的分块，无需指定输入输出路径（可选）")
+    parser.add_argument("--worker-id", nargs='?', help="工作进程标识（可选，默认 主机名:进程号）")
     # 2. 解析命令行参数
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     args_dict = vars(args)  # 转换为字典，方便处理
     # 3. 定义必填参数列表（根据实际需求修改）
-    required_args = ["input", "output"]
+    required_args = [] if args_dict["worker"] else ["input", "output"]  # 工作进程的输入输出路径取自工作队列
     # 4. 检查必填参数是否完整，不完整则提示用户输入
     for arg in required_args:
         if args_dict[arg] is None or args_dict[arg].strip() == "":
@@ -68,7 +85,93 @@ def get_command_line_args():
                 print(f"错误：{arg} 不能为空，请重新输入！")
     return args_dict
 
-config = Config()
-logger = setup_logger()
-table = load_json_to_dict("table.json")
-params = get_command_line_args()
\ No newline at end of file
+T = TypeVar("T")
+
+
+def _lazy(factory: Callable[["AppContext"], T]) -> property:
+    """惰性创建的共享资源：第一次访问时才创建（加锁，读文件线程和事件循环可能同时访问）"""
+    name = factory.__name__
+
+    @wraps(factory)
+    def getter(self: "AppContext") -> T:
+        value = self._resources.get(name)
+        if value is None:
+            with self._lock:
+                value = self._resources.get(name)
+                if value is None:
+                    value = self._resources[name] = factory(self)
+        return value
+    return property(getter)
+
+
+class AppContext:
+    """
+    应用上下文：配置、命令行参数和运行期间共享的资源，在入口处创建一次并显式传给各模块
+
+    导入各模块没有副作用；table、各级缓存等数据库在第一次使用时才打开，
+    作为库使用或在工作进程中只需用 Config 和参数字典构造即可，不会解析命令行或提示输入
+    """
+
+    def __init__(self, config: Config, params: Optional[Dict] = None):
+        self.config = config
+        self.params = params or {}
+        self.logger = setup_logger()
+        self._lock = threading.Lock()
+        self._resources: Dict[str, object] = {}
+        normalization_cache.resize(int(config.normalize_cache_mb * 1024 * 1024))
+
+    @_lazy
+    def table(self) -> TableStore:
+        # --dry-run 只估算，不修改 table
+        return TableStore(self.config.table_path, legacy_json="table.json", read_only=bool(self.params.get("dry_run")))
+
+    @_lazy
+    def limiter(self) -> AdaptiveRateLimiter:
+        return AdaptiveRateLimiter(self.config.requests_per_minute, self.config.tokens_per_minute)
+
+    @_lazy
+    def chunk_cache(self) -> ChunkCache:
+        return ChunkCache(self.config.chunk_cache_path)
+
+    @_lazy
+    def encoding_cache(self) -> EncodingCache:
+        return EncodingCache(self.config.encoding_cache_path)
+
+    @_lazy
+    def manifest(self) -> Manifest:
+        return Manifest(self.config.manifest_path)
+
+    @_lazy
+    def token_counter(self) -> TokenCounter:
+        return get_token_counter(self.config.tokenizer)
+
+    @_lazy
+    def token_usage(self) -> TokenUsage:
+        return TokenUsage(self.config.prompt_price, self.config.completion_price)
+
+    @_lazy
+    def work_queue(self) -> WorkQueue:
+        return WorkQueue(self.config.work_queue_path, self.config.lease_seconds, self.config.lease_max_attempts)
+
+    @_lazy
+    def cpu_pool(self) -> CpuPool:
+        return CpuPool(self.config.cpu_workers, self.config.cpu_offload_min_chars)
+
+    def output_path_for(self, file_path: str) -> str:
+        """源文件对应的输出文件路径"""
+        params = self.params
+        return os.path.join(params['output'], os.path.relpath(file_path, params['input'])) if params["input"]!=file_path else os.path.join(params['output'], os.path.basename(file_path))
+
+    def close(self) -> None:
+        """提交并关闭已打开的数据库，结束进程池（之后再访问会重新创建）"""
+        with self._lock:
+            resources = [self._resources.pop(name) for name in ("table", "chunk_cache", "encoding_cache", "manifest", "work_queue", "cpu_pool")
+                         if name in self._resources]
+        for resource in resources:
+            resource.close()
+
+
+def create_app_context(argv: Optional[List[str]] = None, config_path: str = "config.json") -> AppContext:
+    """命令行入口：读取配置、解析命令行参数（不完整时提示输入），创建应用上下文"""
+    config = Config(config_path)
+    return AppContext(config, get_command_line_args(argv))
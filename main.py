@@ -1,33 +1,249 @@
 import os
+import socket
 import time
-from config import Config
-from file import read_files_by_extensions
-from init_project import config, logger, table, params
-from file_process import FileProcess
+from functools import partial
+from file import iter_files_by_extensions, read_source_file, atomic_write
+from init_project import AppContext, create_app_context
+from metrics import metrics
+from file_process import FileProcess, chunk_token_budget
+from api import close_connection_pools
+from normalize_cache import normalization_cache
+from scheduler import ChunkScheduler
+from chunker import split_into_chunk_spans
+from resume_index import ResumeIndex, ResumeRecord, PrefixHasher
+from manifest import git_changed_files
+from reannotate import plan_reannotation
+from dry_run import dry_run
+from batcher import ChunkBatcher
+from output_writer import OutputWriter
+from distributed import enqueue_files, run_worker, queue_summary
 import asyncio
-from typing import Dict, List
-from json_dict import save_dict_to_json
+from config import Config
+from typing import Callable, Iterator, List, Optional, Set, Tuple
 from check_comment import check_code, check_code_with_content, filter_space_and_comment
 
-async def split_file_and_process(file_path: str, file_content: List[str]) -> bool:
+async def split_file_and_process(ctx: AppContext, scheduler: ChunkScheduler, file_path: str, file_content: List[str], budget: int, start_line: int = 0) -> bool:
+    """从第 start_line 行开始处理文件，分块结果按顺序交给 OutputWriter 成批写入，落盘后在断点索引中记录边界"""
     start_time = time.strftime("%H:%M:%S")
     print(f"[{start_time}] 开始处理文件：{file_path}")
-    content=""
+    # 按token预算切分，优先在顶层定义之间切开
+    code_type = os.path.splitext(file_path)[1].lower()
+    spans=[(start_line+start, start_line+end) for start, end in split_into_chunk_spans(file_content[start_line:], code_type, ctx.token_counter, budget)] or [(start_line, start_line)]
+    # 所有分块立即交给调度器并发生成，写入时仍按分块顺序进行
+    file_processes=[FileProcess(ctx, file_path, "".join(line+"\n" for line in file_content[start:end])) for start, end in spans]
+    tasks=[scheduler.submit(partial(file_process.generate, scheduler.batcher)) for file_process in file_processes]
+    hasher=PrefixHasher(code_type)
+    hasher.update(file_content[:start_line])
     success=True
-    for line in file_content:
-        if ((len(content)>5000 and line!="" and line[0]!=" ") or (line=="" and len(content)>2500)) and content!="":
-            file_process=FileProcess(file_path, content)
-            success=await file_process.process() and success
-            content=line+"\n" if line!="" else ""
-        else:
-            content+=(line+"\n")
-    file_process=FileProcess(file_path, content)
-    success=await file_process.process() and success
+    with OutputWriter(file_processes[0].output_file_path, ctx.config.output_commit_bytes, ctx.config.output_fsync) as writer:
+        for (_, end), file_process, task in zip(spans, file_processes, tasks):
+            chunk_success=await task
+            success=chunk_success and ctx.table.commit() and success
+            # 只记录连续成功的分块，续跑时从第一个失败的分块重新开始
+            if success:
+                hasher.update(file_content[hasher.line:end])
+            writer.add(file_process.output_text(chunk_success), (end, hasher.hexdigest()) if success else None)
     end_time = time.strftime("%H:%M:%S")
     print(f"[{end_time}] 结束处理文件：{file_path}")
     return success
 
+def find_legacy_resume_line(content: List[str], comment_content: List[str], code_type: str) -> int:
+    """
+    没有断点索引的旧输出：找到规范化后恰好等于已有输出的源码前缀，返回下一行的行号，找不到返回 -1
+    逐行比较前缀（startswith 指定位置），总耗时与文件长度成线性
+    """
+    comment_text=filter_space_and_comment("\n".join(comment_content), code_type)
+    position=0
+    for i, line in enumerate(content):
+        normalized=filter_space_and_comment(line, code_type)
+        if not comment_text.startswith(normalized, position):
+            return -1
+        position+=len(normalized)
+        if position==len(comment_text):
+            return i+1
+    return -1
+
+async def reannotate_file(ctx: AppContext, scheduler: ChunkScheduler, file_path: str, comment_path: str, content: List[str], comment_content: List[str], budget: int) -> Optional[bool]:
+    """
+    按 diff 重新注释有改动的文件：未改动区域沿用已有输出，改动区域（含少量上下文）按token预算切分后交给模型，
+    全部成功后拼接并原子替换输出文件；有分块失败时保留原输出并返回 False，改动太大时返回 None（改为整体重新注释）
+    """
+    code_type = os.path.splitext(file_path)[1].lower()
+    pieces=plan_reannotation(content, comment_content, code_type, ctx.config.diff_context_lines)
+    if pieces is None:
+        return None
+    print(f"文件{file_path}有改动，重新注释其中{sum(len(piece.lines) for piece in pieces if not piece.reuse)}行，其余沿用已有注释")
+    # 所有需要重新注释的分块立即并发生成
+    piece_jobs=[]
+    for piece in pieces:
+        jobs=[]
+        if not piece.reuse:
+            for start, end in split_into_chunk_spans(piece.lines, code_type, ctx.token_counter, budget):
+                file_process=FileProcess(ctx, file_path, "\n".join(piece.lines[start:end]))
+                jobs.append((start, end, file_process, scheduler.submit(partial(file_process.generate, scheduler.batcher))))
+        piece_jobs.append(jobs)
+    new_lines=[]
+    success=True
+    for piece, jobs in zip(pieces, piece_jobs):
+        if piece.reuse:
+            new_lines.extend(piece.lines)
+            continue
+        position=0
+        for start, end, file_process, task in jobs:
+            # 切分时丢弃的空行原样保留
+            new_lines.extend(piece.lines[position:start])
+            success=await task and success
+            generated=file_process.generate_content.split("\n")
+            while generated and generated[-1]=="":
+                generated.pop()
+            # 生成结果末尾的空行按源码补齐
+            trailing=0
+            while trailing<end-start and piece.lines[end-1-trailing]=="":
+                trailing+=1
+            new_lines.extend(generated+[""]*trailing)
+            position=end
+        new_lines.extend(piece.lines[position:])
+    ctx.table.commit()
+    if not success:
+        print(f"{file_path}部分改动注释失败，保留原输出")
+        ctx.logger.error(f"{file_path}部分改动注释失败，保留原输出")
+        return False
+    atomic_write(comment_path, "\n".join(new_lines))
+    # 输出已完整对应当前源码，断点索引只保留一条覆盖全文的记录
+    hasher=PrefixHasher(code_type)
+    hasher.update(content)
+    ResumeIndex(comment_path).reset([ResumeRecord(len(content), hasher.hexdigest(), os.path.getsize(comment_path))])
+    return True
+
+async def resume_from(ctx: AppContext, scheduler: ChunkScheduler, file_path: str, content: List[str], budget: int, resume_index: ResumeIndex, record: ResumeRecord) -> bool:
+    """截掉 record 之后的输出，从 record 记录的行继续处理"""
+    resume_index.truncate_to(record)
+    if record.line>=len(content):
+        print(f"文件{file_path}已处理或无需处理，跳过")
+        return True
+    print(f"文件{file_path}从第{record.line+1}行继续处理")
+    return await split_file_and_process(ctx, scheduler, file_path, content, budget, record.line)
+
+async def resume_and_process(ctx: AppContext, scheduler: ChunkScheduler, file_path: str, comment_path: str, content: List[str], budget: int) -> bool:
+    """已有输出时按断点索引（或旧输出的前缀）续跑，输出文件只在需要时读取"""
+    code_type = os.path.splitext(file_path)[1].lower()
+    resume_index=ResumeIndex(comment_path)
+    if not os.path.isfile(comment_path):
+        resume_index.reset()
+        return await split_file_and_process(ctx, scheduler, file_path, content, budget)
+    # 优先按断点索引续跑：从最后一个与源码一致的分块之后继续，截掉其后不完整的输出
+    record=resume_index.find_resume_point(content, code_type)
+    records=resume_index.load()
+    # 之后还有对不上的记录，说明源码被修改过（而不是上次中途退出），此时优先按 diff 只重新注释改动部分
+    edited=record is None or record!=records[-1]
+    if record is not None and not (edited and ctx.config.diff_reannotate):
+        return await resume_from(ctx, scheduler, file_path, content, budget, resume_index, record)
+    # 读取带注释的原始输出：校验、旧输出续跑和按改动重新注释共用
+    comment_content=await asyncio.get_running_loop().run_in_executor(None, read_source_file, comment_path, False, ctx.encoding_cache)
+    if comment_content is not None and await ctx.cpu_pool.run(sum(map(len, content)), check_code_with_content, "\n".join(content), "\n".join(comment_content), code_type):
+        print(f"文件{file_path}已处理或无需处理，跳过")
+        return True
+    if not records:
+        start_line=find_legacy_resume_line(content, comment_content, code_type) if comment_content is not None else -1
+        if start_line!=-1:
+            return await split_file_and_process(ctx, scheduler, file_path, content, budget, start_line)
+    if ctx.config.diff_reannotate and comment_content is not None:
+        # 源码有改动：只重新注释改动的部分，其余沿用已有注释
+        result=await reannotate_file(ctx, scheduler, file_path, comment_path, content, comment_content, budget)
+        if result is not None:
+            return result
+    if record is not None:
+        return await resume_from(ctx, scheduler, file_path, content, budget, resume_index, record)
+    resume_index.truncate_to(None)
+    return await split_file_and_process(ctx, scheduler, file_path, content, budget)
+
+@metrics.timed("process_file")
+async def process_file(ctx: AppContext, scheduler: ChunkScheduler, file_path: str, content: List[str], budget: int) -> bool:
+    """处理单个文件，成功后在指纹清单中记录源文件和输出文件"""
+    code_type = os.path.splitext(file_path)[1].lower()
+    comment_path = ctx.output_path_for(file_path)
+    # 源文件只改了空白、注释或修改时间，且输出文件未变化
+    if ctx.manifest.is_same_content(file_path, comment_path, content, code_type):
+        print(f"文件{file_path}已处理或无需处理，跳过")
+        success = True
+    else:
+        success = await resume_and_process(ctx, scheduler, file_path, comment_path, content, budget)
+    if success:
+        ctx.manifest.record(file_path, comment_path, content, code_type)
+    else:
+        ctx.manifest.forget(file_path)
+    return success
+
+def make_skip_filter(ctx: AppContext, since_files: Optional[Set[str]]) -> Callable[[str], bool]:
+    """
+    遍历时判断文件是否无需读取：指纹清单中源文件和输出文件都未变化，
+    或指定了 --since 时文件自该版本以来没有改动且已有完整的输出（指纹清单中记录过处理完成，输出文件未变化）；
+    中断的运行留下的不完整输出不跳过，读取后从断点继续
+    """
+    def skip(file_path: str) -> bool:
+        comment_path = ctx.output_path_for(file_path)
+        if since_files is not None and os.path.realpath(file_path) not in since_files and ctx.manifest.has_output(file_path, comment_path):
+            return True
+        return ctx.manifest.is_unchanged(file_path, comment_path)
+    return skip
+
+async def process_files(ctx: AppContext, files: Iterator[Tuple[str, List[str]]]) -> None:
+    """
+    在同一个事件循环中调度所有文件，全局并发数由 config.max_concurrency 控制
+    files 为边遍历边读取的迭代器，在线程中取下一个文件，同时在处理中的文件不超过 config.max_pending_files 个
+    """
+    config = ctx.config
+    scheduler = ChunkScheduler(config.max_concurrency)
+    budget = chunk_token_budget(ctx)
+    if config.batch_max_chunks > 1:
+        # 小分块合并为一个请求，合并后的代码总量不超过单个分块的预算
+        scheduler.batcher = ChunkBatcher(ctx, scheduler, config.batch_max_chunks, budget, config.batch_chunk_tokens, config.batch_wait)
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(config.max_pending_files)
+    jobs = []
+    while True:
+        await slots.acquire()
+        item = await loop.run_in_executor(None, next, files, None)
+        if item is None:
+            slots.release()
+            break
+        file_path, content = item
+        job = asyncio.ensure_future(process_file(ctx, scheduler, file_path, content, budget))
+        job.add_done_callback(lambda _: slots.release())
+        jobs.append(job)
+    await asyncio.gather(*jobs)
+
+def print_estimate(config: Config, estimate: dict, top_files: int = 10) -> None:
+    """打印 --dry-run 的估算结果"""
+    print(f"待处理文件：{estimate['files']} 个（跳过未变化的文件 {estimate['skipped_files']} 个）")
+    print(f"分块：{estimate['chunks']} 个，其中 table 命中 {estimate['table_hits']} 个、分块缓存命中 {estimate['cache_hits']} 个、"
+          f"只需为部分代码调用API {estimate['partial_hits']} 个")
+    print(f"预计API调用：{estimate['calls']} 次（不含重试），输入 {estimate['prompt_tokens']} token，输出约 {estimate['completion_tokens']} token")
+    if config.prompt_price or config.completion_price:
+        print(f"预计费用：{estimate['cost']:.4f}")
+    print(f"预计耗时：{estimate['wall_seconds']:.0f} 秒（并发 {config.max_concurrency}）")
+    files = sorted(estimate["by_file"].items(), key=lambda item: -(item[1]["prompt_tokens"] + item[1]["completion_tokens"]))
+    if files:
+        print(f"token 用量最多的文件：")
+        for file_path, item in files[:top_files]:
+            resumed = f"，从第{item['start_line']+1}行续跑" if item["start_line"] else ""
+            print(f"  {file_path}：{item['calls']} 次调用，{item['prompt_tokens'] + item['completion_tokens']} token{resumed}")
+
+def record_cache_metrics(ctx: AppContext) -> None:
+    """把各级缓存的命中情况记为指标"""
+    chunk_cache, encoding_cache, manifest = ctx.chunk_cache, ctx.encoding_cache, ctx.manifest
+    for name, hits, misses in (("chunk_cache", chunk_cache.hits, chunk_cache.misses),
+                               ("encoding_cache", encoding_cache.hits, encoding_cache.misses),
+                               ("normalization_cache", normalization_cache.hits, normalization_cache.misses)):
+        metrics.set_gauge("cache_hits", hits, {"cache": name})
+        metrics.set_gauge("cache_misses", misses, {"cache": name})
+    metrics.set_gauge("manifest_skipped_files", manifest.skipped)
+    metrics.set_gauge("table_fuzzy_lines", ctx.table.fuzzy_hits)
+    metrics.set_gauge("table_fuzzy_chunks", ctx.table.fuzzy_chunks)
+
 if __name__ == "__main__":
+    ctx = create_app_context()
+    config, params = ctx.config, ctx.params
     if params['verbose']:
         print("\n开始处理...")
         print(f"输入路径: {params['input']}")
@@ -36,32 +252,41 @@ if __name__ == "__main__":
         print("配置信息：")
         print(config)
     
-    files = read_files_by_extensions(params['input'], filter_comment=True)
-    comment_files = read_files_by_extensions(params['output'], filter_comment=True)
-    for file_path, content in files.items():
-        code_type = os.path.splitext(file_path)[1].lower()
-        comment_path=os.path.join(params['output'], os.path.relpath(file_path, params['input'])) if params["input"]!=file_path else os.path.join(params['output'], os.path.basename(file_path))
-        if file_path in comment_files or (comment_path in comment_files and check_code_with_content("".join(content),"".join(comment_files[comment_path]), code_type)):
-            print(f"文件{file_path}已处理或无需处理，跳过")
-            continue
-        elif comment_path in comment_files:
-            text=""
-            comment_content=filter_space_and_comment("".join(comment_files[comment_path]), code_type)
-            comment_valid=False
-            for i in range(len(content)):
-                text+=filter_space_and_comment(content[i], code_type)
-                if len(text)==len(comment_content) and text==comment_content:
-                    success=asyncio.run(split_file_and_process(file_path, content[i+1:]))
-                    comment_valid=True
-                    break
-            if not comment_valid:
-                with open(comment_path, "w", encoding="utf-8") as f:
-                    f.write("")
+    if config.metrics_port:
+        metrics.serve(config.metrics_port)
+        print(f"实时指标：http://127.0.0.1:{config.metrics_port}/metrics")
+    with metrics.span("run"):
+        if params['worker']:
+            # 工作进程：输入输出路径取自协调进程写入工作队列的记录
+            queue = ctx.work_queue
+            for key in ("input", "output"):
+                params[key] = params[key] or queue.get_meta(key)
+            asyncio.run(run_worker(ctx, queue, params['worker_id'] or f"{socket.gethostname()}:{os.getpid()}"))
+            print(f"工作队列：{queue_summary(queue)}")
         else:
-            success=asyncio.run(split_file_and_process(file_path, content))
+            since_files = git_changed_files(params['input'], params['since']) if params['since'] else None
+            # 输出目录位于输入目录内时跳过输出目录；未变化的文件不读取
+            files = iter_files_by_extensions(config, params['input'], filter_comment=True, exclude=params['output'],
+                                             skip=make_skip_filter(ctx, since_files), encoding_cache=ctx.encoding_cache)
+            if params['dry_run']:
+                print_estimate(config, dry_run(ctx, files, chunk_token_budget(ctx)))
+            elif params['coordinator']:
+                queued_files, queued_units = enqueue_files(ctx, ctx.work_queue, files, chunk_token_budget(ctx))
+                print(f"加入工作队列：{queued_files} 个文件，{queued_units} 个分块；{queue_summary(ctx.work_queue)}")
+            else:
+                asyncio.run(process_files(ctx, files))
 
-    save_dict_to_json(table, "table.json")
+    close_connection_pools()
+    record_cache_metrics(ctx)
+    if ctx.table.fuzzy_chunks:
+        print(f"按规范化代码复用已有注释 {ctx.table.fuzzy_hits} 行，{ctx.table.fuzzy_chunks} 个分块因此无需调用API")
+    ctx.close()
+    if config.metrics_path:
+        metrics.dump(config.metrics_path, config.metrics_format)
+    if not (params['dry_run'] or params['coordinator']):
+        print(ctx.token_usage.format_total())
+        if config.usage_path:
+            ctx.token_usage.dump(config.usage_path)
+    if params['verbose']:
+        print(f"规范化缓存：{normalization_cache.stats()}")
     print("处理完成！")
-    
-
- 
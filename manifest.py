@@ -0,0 +1,158 @@
+import hashlib
+import os
+import sqlite3
+import subprocess
+import threading
+from typing import Dict, List, Optional, Set
+from filter_comment import filter_space_and_comment
+
+
+class Manifest:
+    """
+    已处理文件的指纹清单（SQLite）
+
+    每个源文件记录 (大小, 修改时间, 规范化内容哈希) 和对应输出文件的 (大小, 修改时间, 内容哈希)；
+    源文件和输出文件的大小、修改时间都未变化时，不打开文件即可判定为已处理。
+    新记录先缓存在内存中，每 COMMIT_EVERY 条在一个短事务中写入，多个进程共用同一个清单时不会长时间占用写锁
+    """
+
+    COMMIT_EVERY = 64
+
+    def __init__(self, db_path: str = "manifest.db"):
+        self.db_path = db_path
+        dir_path = os.path.dirname(db_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        # 遍历目录的线程和事件循环线程都会访问；多个工作进程共用时其他进程持有写锁最多等待 30 秒
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, "
+            "source_hash TEXT NOT NULL, output_path TEXT NOT NULL, output_size INTEGER NOT NULL, "
+            "output_mtime INTEGER NOT NULL, output_hash TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Optional[tuple]] = {}  # 尚未写入数据库的记录，None 表示删除
+        self.skipped = 0
+
+    @staticmethod
+    def source_hash(content: List[str], code_type: str) -> str:
+        """源码去掉空白和注释后的哈希，只改动空白或注释时不变"""
+        normalized = filter_space_and_comment("\n".join(content), code_type)
+        return hashlib.sha256(normalized.encode("utf-8", "surrogatepass")).hexdigest()
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _row(self, path: str):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._pending:
+                row = self._pending[path]
+                return row[1:7] if row is not None else None
+            return self._conn.execute(
+                "SELECT size, mtime, source_hash, output_path, output_size, output_mtime FROM files WHERE path = ?",
+                (path,)
+            ).fetchone()
+
+    @staticmethod
+    def _output_unchanged(row, output_path: str) -> bool:
+        try:
+            stat = os.stat(output_path)
+        except OSError:
+            return False
+        return row[3] == os.path.abspath(output_path) and (stat.st_size, stat.st_mtime_ns) == (row[4], row[5])
+
+    def is_unchanged(self, path: str, output_path: str) -> bool:
+        """只用 stat 判断：源文件和输出文件都与记录一致"""
+        row = self._row(path)
+        if row is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if (stat.st_size, stat.st_mtime_ns) != (row[0], row[1]) or not self._output_unchanged(row, output_path):
+            return False
+        self.skipped += 1
+        return True
+
+    def has_output(self, path: str, output_path: str) -> bool:
+        """已记录该文件处理完成，且输出文件与记录一致（不检查源文件，用于 --since 判定为未改动的文件）"""
+        row = self._row(path)
+        return row is not None and self._output_unchanged(row, output_path)
+
+    def is_same_content(self, path: str, output_path: str, content: List[str], code_type: str) -> bool:
+        """源文件被改动过（如只改了注释或被 touch），但规范化内容与记录一致、输出文件也未变化"""
+        row = self._row(path)
+        return row is not None and row[2] == self.source_hash(content, code_type) and self._output_unchanged(row, output_path)
+
+    def record(self, path: str, output_path: str, content: List[str], code_type: str) -> None:
+        """文件处理完成后记录源文件和输出文件的指纹"""
+        try:
+            stat = os.stat(path)
+            output_stat = os.stat(output_path)
+            output_hash = self.file_hash(output_path)
+        except OSError:
+            return
+        source_hash = self.source_hash(content, code_type)
+        path = os.path.abspath(path)
+        with self._lock:
+            self._pending[path] = (path, stat.st_size, stat.st_mtime_ns, source_hash,
+                                   os.path.abspath(output_path), output_stat.st_size, output_stat.st_mtime_ns, output_hash)
+            if len(self._pending) >= self.COMMIT_EVERY:
+                self._flush()
+
+    def forget(self, path: str) -> None:
+        with self._lock:
+            self._pending[os.path.abspath(path)] = None
+            if len(self._pending) >= self.COMMIT_EVERY:
+                self._flush()
+
+    def _flush(self) -> bool:
+        """在一个事务中写入缓存的记录（调用方持有 _lock），失败时记录保留在内存中，下次写入时重试"""
+        if not self._pending:
+            return True
+        try:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                       (row for row in self._pending.values() if row is not None))
+                self._conn.executemany("DELETE FROM files WHERE path = ?",
+                                       ((path,) for path, row in self._pending.items() if row is None))
+        except sqlite3.Error as e:
+            print(f"保存指纹清单失败：{str(e)}")
+            return False
+        self._pending = {}
+        return True
+
+    def commit(self) -> bool:
+        with self._lock:
+            return self._flush()
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+
+def git_changed_files(path: str, revision: str) -> Optional[Set[str]]:
+    """
+    path 所在 git 仓库中自 revision 以来有改动（含工作区未提交的改动和未跟踪文件）的文件绝对路径
+    不是 git 仓库或 git 命令失败时返回 None
+    """
+    directory = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+    try:
+        top = subprocess.run(["git", "-C", directory, "rev-parse", "--show-toplevel"],
+                             capture_output=True, text=True, check=True).stdout.strip()
+        changed = subprocess.run(["git", "-C", top, "diff", "--name-only", "-z", revision, "--"],
+                                 capture_output=True, text=True, check=True).stdout
+        untracked = subprocess.run(["git", "-C", top, "ls-files", "--others", "--exclude-standard", "-z"],
+                                   capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"获取 git 改动文件失败（{revision}）：{str(e)}")
+        return None
+    return {os.path.realpath(os.path.join(top, name)) for name in (changed + untracked).split("\0") if name}
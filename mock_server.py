@@ -0,0 +1,269 @@
+"""
+本地模拟的 OpenAI 兼容接口（/v1/chat/completions），用于在没有真实 api_url 时测试和压测
+
+按确定的规则给提示词中的代码逐行加注释，可配置延迟、服务端错误率、429 限流、输出截断、格式错误的代码块和 SSE 流式输出；
+批量请求（多个带 id=编号 标记的代码块）逐块加注释后按原标记输出，格式错误时漏掉其中一块；
+同一提示词第 n 次请求的结果只由 (seed, 提示词, n) 决定，与并发顺序无关
+
+用法：python mock_server.py [--port 8000] [--latency 0.05] [--error-rate 0.05] [--rate-429 0.02] ...
+GET /stats 返回请求计数（JSON）
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+_PROMPT_RE = re.compile(r"路径:(?P<path>.*?)的文件中包含如下代码片段：\n(?P<code>.*)\n请给出逐行详细注释", re.DOTALL)
+_BATCH_BLOCK_RE = re.compile(r"路径:(?P<path>[^\n]*)：\n```(?P<info>[^\n]*\bid=\d+)\n(?P<code>.*?)\n```", re.DOTALL)
+_LINE_COMMENT = {".py": "#", ".html": None}
+
+
+class MockOptions:
+    def __init__(self, latency: float = 0.0, ms_per_token: float = 0.0, error_rate: float = 0.0,
+                 rate_429: float = 0.0, retry_after: float = 1.0, truncate_rate: float = 0.0,
+                 malformed_rate: float = 0.0, comment_line_rate: float = 0.1, seed: int = 0):
+        self.latency = latency  # 每个请求的固定延迟（秒）
+        self.ms_per_token = ms_per_token  # 每个输出token的额外延迟（毫秒）
+        self.error_rate = error_rate  # 返回 500 的概率
+        self.rate_429 = rate_429  # 返回 429 的概率
+        self.retry_after = retry_after  # 429 响应的 Retry-After（秒）
+        self.truncate_rate = truncate_rate  # 输出被截断（finish_reason=length）的概率
+        self.malformed_rate = malformed_rate  # 输出拆成多个代码块的概率
+        self.comment_line_rate = comment_line_rate  # 在代码行前插入纯注释行的概率
+        self.seed = seed
+
+
+def annotate(code: str, file_path: str, rng: random.Random, comment_line_rate: float = 0.1) -> str:
+    """逐行加注释：非空行行尾加注释，偶尔在其前插入一行纯注释；HTML 等无行注释的语言原样返回"""
+    ext = file_path[file_path.rfind("."):].lower() if "." in file_path else ""
+    marker = _LINE_COMMENT.get(ext, "//")
+    if marker is None:
+        return code
+    result = []
+    for i, line in enumerate(code.split("\n")):
+        stripped = line.strip()
+        if stripped == "":
+            result.append(line)
+            continue
+        indent = line[:len(line) - len(line.lstrip())]
+        if rng.random() < comment_line_rate:
+            result.append(f"{indent}{marker} 第{i + 1}行说明")
+        result.append(f"{line}  {marker} 注释{i + 1}")
+    return "\n".join(result)
+
+
+class MockState:
+    """请求计数和每个提示词的请求次数（决定第 n 次请求的随机数种子）"""
+
+    def __init__(self, options: MockOptions):
+        self.options = options
+        self._lock = threading.Lock()
+        self._attempts: Dict[str, int] = {}
+        self.stats: Dict[str, float] = {
+            "requests": 0, "ok": 0, "errors_500": 0, "errors_429": 0, "truncated": 0, "malformed": 0,
+            "stream_requests": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "first_request_at": 0.0, "last_response_at": 0.0
+        }
+
+    def next_rng(self, prompt: str) -> random.Random:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+            self.stats["requests"] += 1
+            if not self.stats["first_request_at"]:
+                self.stats["first_request_at"] = time.time()
+        return random.Random(f"{self.options.seed}:{digest}:{attempt}")
+
+    def count(self, key: str, value: float = 1) -> None:
+        with self._lock:
+            self.stats[key] += value
+
+    def finish(self) -> None:
+        with self._lock:
+            self.stats["last_response_at"] = time.time()
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.stats)
+
+
+def build_reply(state: MockState, request: Dict) -> Tuple[int, Dict[str, str], Optional[str], str, Dict]:
+    """
+    按请求生成回复
+
+    返回: (状态码, 额外响应头, 输出内容（错误时为 None）, finish_reason, usage)
+    """
+    options = state.options
+    messages = request.get("messages") or [{}]
+    prompt = messages[-1].get("content", "")
+    rng = state.next_rng(prompt)
+    roll = rng.random()
+    if roll < options.rate_429:
+        state.count("errors_429")
+        return 429, {"Retry-After": str(options.retry_after)}, None, "", {}
+    if roll < options.rate_429 + options.error_rate:
+        state.count("errors_500")
+        return 500, {}, None, "", {}
+    batch = list(_BATCH_BLOCK_RE.finditer(prompt))
+    if batch:
+        blocks = [f"```{match.group('info')}\n{annotate(match.group('code'), match.group('path'), rng, options.comment_line_rate)}\n```"
+                  for match in batch]
+        if rng.random() < options.malformed_rate:
+            state.count("malformed")
+            del blocks[rng.randrange(len(blocks))]
+        content = "\n\n".join(blocks)
+    else:
+        match = _PROMPT_RE.search(prompt)
+        file_path, code = (match.group("path"), match.group("code")) if match else ("", prompt)
+        annotated = annotate(code, file_path, rng, options.comment_line_rate)
+        lang = file_path[file_path.rfind(".") + 1:] if "." in file_path else ""
+        if rng.random() < options.malformed_rate:
+            state.count("malformed")
+            lines = annotated.split("\n")
+            half = len(lines) // 2
+            content = f"```{lang}\n" + "\n".join(lines[:half]) + "\n```\n\n```" + lang + "\n" + "\n".join(lines[half:]) + "\n```"
+        else:
+            content = f"```{lang}\n{annotated}\n```"
+    finish_reason = "stop"
+    max_chars = int(request.get("max_tokens") or 0) * 3
+    truncate_at = len(content) // 2 if rng.random() < options.truncate_rate else len(content)
+    if max_chars:
+        # 按字符粗略估算 max_tokens，超出的部分与真实接口一样被截掉
+        truncate_at = min(truncate_at, max_chars)
+    if truncate_at < len(content):
+        state.count("truncated")
+        content = content[:truncate_at]
+        finish_reason = "length"
+    usage = {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(content) // 3}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    state.count("prompt_tokens", usage["prompt_tokens"])
+    state.count("completion_tokens", usage["completion_tokens"])
+    state.count("ok")
+    return 200, {}, content, finish_reason, usage
+
+
+def _split_deltas(content: str, size: int = 24) -> List[str]:
+    return [content[i:i + size] for i in range(0, len(content), size)] or [""]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.state.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+        options = self.state.options
+        status, headers, content, finish_reason, usage = build_reply(self.state, request)
+        if options.latency:
+            time.sleep(options.latency)
+        if content is None:
+            message = "rate limited" if status == 429 else "internal error"
+            self._send_json(status, {"error": {"message": message}}, headers)
+            self.state.finish()
+            return
+        delay = options.ms_per_token * usage["completion_tokens"] / 1000
+        if request.get("stream"):
+            self.state.count("stream_requests")
+            self._send_stream(content, finish_reason, usage, delay)
+        else:
+            if delay:
+                time.sleep(delay)
+            self._send_json(200, {
+                "id": "mock", "object": "chat.completion", "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+                "usage": usage
+            })
+        self.state.finish()
+
+    def _send_stream(self, content: str, finish_reason: str, usage: Dict, delay: float) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        deltas = _split_deltas(content)
+        try:
+            for i, delta in enumerate(deltas):
+                event = {"choices": [{"index": 0, "delta": {"content": delta},
+                                      "finish_reason": finish_reason if i == len(deltas) - 1 else None}]}
+                if i == len(deltas) - 1:
+                    event["usage"] = usage
+                self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                if delay:
+                    time.sleep(delay / len(deltas))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前中止流式输出
+            self.close_connection = True
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def create_server(options: MockOptions, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """创建模拟服务（port 为 0 时自动分配端口，server.server_address[1] 为实际端口），调用方负责 serve_forever"""
+    handler = type("BoundMockHandler", (MockHandler,), {"state": MockState(options)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = handler.state
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--ms-per-token", type=float, default=0.0, help="每个输出token的额外延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="输出被截断的概率")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="输出拆成多个代码块的概率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    options = MockOptions(args.latency, args.ms_per_token, args.error_rate, args.rate_429, args.retry_after,
+                          args.truncate_rate, args.malformed_rate, seed=args.seed)
+    server = create_server(options, args.host, args.port)
+    print(f"模拟接口：http://{args.host}:{server.server_address[1]}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
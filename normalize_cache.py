@@ -0,0 +1,73 @@
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+
+class NormalizationCache:
+    """
+    规范化结果（去掉空白和注释后的代码）的内存 LRU 缓存
+
+    键为 (内容哈希, 代码类型)，按规范化结果的字符数计算占用，超出 max_bytes 时淘汰最久未使用的条目；
+    很短的文本（如单行代码）规范化本身比计算哈希还快，不进入缓存
+    """
+
+    ENTRY_OVERHEAD = 128  # 每个条目的键、字典槽位等额外开销（估算）
+    MIN_LENGTH = 256  # 短于该长度的文本不缓存
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[bytes, str], str]" = OrderedDict()
+
+    @staticmethod
+    def make_key(content: str, code_type: str) -> Tuple[bytes, str]:
+        return hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).digest(), code_type
+
+    def get_or_compute(self, content: str, code_type: str, compute: Callable[[str, str], str]) -> str:
+        """命中时直接返回缓存结果，否则调用 compute(content, code_type) 并写入缓存"""
+        if len(content) < self.MIN_LENGTH or self.max_bytes <= 0:
+            return compute(content, code_type)
+        key = self.make_key(content, code_type)
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute(content, code_type)
+        cost = len(value) + self.ENTRY_OVERHEAD
+        if cost > self.max_bytes:
+            return value
+        self._entries[key] = value
+        self.size += cost
+        self._evict()
+        return value
+
+    def resize(self, max_bytes: int) -> None:
+        """调整容量上限，必要时立即淘汰"""
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def _evict(self) -> None:
+        while self.size > self.max_bytes and self._entries:
+            _, value = self._entries.popitem(last=False)
+            self.size -= len(value) + self.ENTRY_OVERHEAD
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "size": self.size, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# 进程内共享的缓存实例，容量由 init_project 按配置调整
+normalization_cache = NormalizationCache()
@@ -0,0 +1,84 @@
+import os
+from typing import List, Optional, Tuple
+from resume_index import ResumeIndex, ResumeRecord
+from metrics import metrics
+
+
+class OutputWriter:
+    """
+    单个输出文件的有序写入器，替代每个分块各打开一次输出文件追加写入
+
+    分块结果按顺序加入缓冲区，攒够 commit_bytes 字节（或结束时）一次性追加写入输出文件并 fsync，
+    之后才把这批分块的边界追加到断点索引（同样 fsync）。索引中的每条记录都指向已经落盘的输出，
+    崩溃时最多丢失最后一批未提交的分块，续跑时按索引截掉不完整的部分（这些分块的结果仍在 table 和分块缓存中）。
+    输出文件和断点索引在处理一个文件期间各只打开一次
+    """
+
+    def __init__(self, output_path: str, commit_bytes: int = 65536, fsync: bool = True):
+        self.output_path = output_path
+        self.resume_index = ResumeIndex(output_path)
+        self.commit_bytes = commit_bytes
+        self.fsync = fsync
+        self._file = None
+        self._index_file = None
+        self._buffer: List[bytes] = []
+        self._buffered_bytes = 0
+        self._records: List[ResumeRecord] = []
+        try:
+            self.offset = os.path.getsize(output_path)  # 已写入（含缓冲区中）的输出字节数
+        except OSError:
+            self.offset = 0
+
+    @staticmethod
+    def encode(text: str) -> bytes:
+        """输出内容写入磁盘的字节：换行按文本模式的规则转换为 os.linesep，与以文本模式写入（如 atomic_write）的结果相同"""
+        return text.replace("\n", os.linesep).encode("utf-8")
+
+    def add(self, text: str, boundary: Optional[Tuple[int, str]] = None) -> None:
+        """按顺序加入一个分块的输出；boundary 为 (已提交的源码行数, 前缀哈希) 时，提交后在断点索引中记录该分块的结尾"""
+        data = self.encode(text)
+        self._buffer.append(data)
+        self._buffered_bytes += len(data)
+        self.offset += len(data)
+        if boundary is not None:
+            self._records.append(ResumeRecord(boundary[0], boundary[1], self.offset))
+        if self._buffered_bytes >= self.commit_bytes:
+            self.commit()
+
+    @metrics.timed("write_output")
+    def commit(self) -> None:
+        """写入缓冲区中的分块，落盘后再追加对应的断点记录"""
+        if self._buffer:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+                self._file = open(self.output_path, "ab")
+            self._file.write(b"".join(self._buffer))
+            self._flush(self._file)
+            self._buffer, self._buffered_bytes = [], 0
+        if self._records:
+            if self._index_file is None:
+                self._index_file = open(self.resume_index.path, "a", encoding="utf-8")
+            self._index_file.writelines(ResumeIndex.format(record) for record in self._records)
+            self._flush(self._index_file)
+            self._records = []
+
+    def _flush(self, f) -> None:
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def close(self) -> None:
+        """提交剩余的分块并关闭文件"""
+        try:
+            self.commit()
+        finally:
+            for f in (self._file, self._index_file):
+                if f is not None:
+                    f.close()
+            self._file = self._index_file = None
+
+    def __enter__(self) -> "OutputWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
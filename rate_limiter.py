@@ -0,0 +1,162 @@
+import asyncio
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    令牌桶：容量为每分钟额度，按 rate/60 每秒匀速补充
+    rate 为 0 表示不限制
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    def set_rate(self, rate_per_minute: float) -> None:
+        """调整速率，已有令牌不超过新容量"""
+        self._refill(time.monotonic())
+        unlimited = self.rate <= 0
+        self.rate = rate_per_minute
+        self.capacity = rate_per_minute
+        # 从不限制切换为限制时桶是满的，否则已有令牌不超过新容量
+        self.tokens = self.capacity if unlimited else min(self.tokens, self.capacity)
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """还需等待多少秒才有 amount 个令牌（单次需求超过容量时按容量计算）"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.rate
+
+    def consume(self, amount: float) -> None:
+        if self.rate > 0:
+            self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        """预估用量多扣的部分退回（amount 为负时补扣）"""
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class AdaptiveRateLimiter:
+    """
+    所有请求共享的自适应限流器，同时限制每分钟请求数和每分钟token数
+
+    被服务端限流（429）时速率减半并按 Retry-After 暂停所有请求，
+    之后每次成功的请求把速率按步长加回，直到恢复配置的上限（AIMD）
+    未配置请求数上限时，以首次被限流时最近一分钟内观测到的请求速率（换算为每分钟）作为上限
+    （样本太少时不学习，只靠 Retry-After 与重试退避）
+    """
+
+    MIN_LEARN_SAMPLES = 10
+    DECREASE_COOLDOWN = 1.0  # 同一波并发请求的多个429只减速一次
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 min_ratio: float = 0.05, increase_step: float = 0.05):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_ratio = min_ratio
+        self.increase_step = increase_step
+        self.ratio = 1.0  # 当前速率占上限的比例
+        self.learned_rpm = 0.0  # 未配置请求数上限时，从限流中学到的上限
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.blocked_until = 0.0  # 服务端要求的暂停截止时间
+        self.throttled_times = 0
+        self._recent = deque()  # 最近一分钟内的请求时间，用于观测实际速率
+        self._last_throttle = 0.0
+        self._last_decrease = float("-inf")
+
+    def _base_rpm(self) -> float:
+        return self.requests_per_minute or self.learned_rpm
+
+    def _apply_ratio(self) -> None:
+        self.request_bucket.set_rate(self._base_rpm() * self.ratio)
+        self.token_bucket.set_rate(self.tokens_per_minute * self.ratio)
+
+    async def acquire(self, tokens: float = 0) -> None:
+        """等待直到可以发出一个消耗约 tokens 个token的请求"""
+        while True:
+            now = time.monotonic()
+            wait = max(
+                self.blocked_until - now,
+                self.request_bucket.wait_time(1, now),
+                self.token_bucket.wait_time(tokens, now),
+            )
+            if wait <= 0:
+                self.request_bucket.consume(1)
+                self.token_bucket.consume(tokens)
+                self._recent.append(now)
+                while self._recent and self._recent[0] < now - 60:
+                    self._recent.popleft()
+                return
+            await asyncio.sleep(wait)
+
+    def on_success(self, estimated_tokens: float = 0, actual_tokens: Optional[float] = None) -> None:
+        """请求成功：用实际用量校正token桶，并逐步恢复速率"""
+        if actual_tokens is not None:
+            self.token_bucket.refund(estimated_tokens - actual_tokens)
+        if self.ratio < 1.0:
+            self.ratio = min(1.0, self.ratio + self.increase_step)
+            self._apply_ratio()
+        elif self.learned_rpm and time.monotonic() - self._last_throttle > 60:
+            # 学到的上限保持满速一分钟未再被限流，则取消该上限
+            self.learned_rpm = 0.0
+            self._apply_ratio()
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        """被服务端限流：速率减半，并让所有请求暂停 retry_after 秒"""
+        now = time.monotonic()
+        self.throttled_times += 1
+        self._last_throttle = now
+        if not self.requests_per_minute and not self.learned_rpm and len(self._recent) >= self.MIN_LEARN_SAMPLES:
+            # 运行不足一分钟时按实际观测时长换算，否则会把上限低估成已发出的请求数
+            window = max(now - self._recent[0], self.DECREASE_COOLDOWN)
+            self.learned_rpm = len(self._recent) * 60 / min(window, 60)
+        if now - self._last_decrease >= max(self.DECREASE_COOLDOWN, retry_after or 0):
+            self._last_decrease = now
+            self.ratio = max(self.min_ratio, self.ratio / 2)
+            self._apply_ratio()
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0,
+                  retry_after: Optional[float] = None) -> float:
+    """
+    第 attempt 次（从0开始）重试前的等待时间：指数退避 + 全抖动
+    服务端给出 Retry-After 时不早于该时间
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
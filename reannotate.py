@@ -0,0 +1,84 @@
+from difflib import SequenceMatcher
+from typing import List, NamedTuple, Optional, Tuple
+from filter_comment import filter_comment_from_code, filter_space
+
+
+class Piece(NamedTuple):
+    """新输出的一段：reuse 为沿用的旧输出行，否则为需要重新注释的源码行"""
+    reuse: bool
+    lines: List[str]
+
+
+def _code_lines(lines: List[str], code_type: str) -> Tuple[List[str], List[int]]:
+    """去掉注释和空白后非空的行：返回 (规范化内容, 行号)；整段过滤注释，跨行注释的中间行不会被当作代码"""
+    filtered = filter_comment_from_code("\n".join(lines), code_type).split("\n")
+    keys, indexes = [], []
+    for i, line in enumerate(filtered):
+        key = filter_space(line)
+        if key:
+            keys.append(key)
+            indexes.append(i)
+    return keys, indexes
+
+
+def _changed_ranges(opcodes, context: int, source_count: int, output_count: int) -> List[Tuple[int, int, int, int]]:
+    """改动区间（按代码行计）前后各扩展 context 行，重叠或相邻的区间合并"""
+    ranges: List[List[int]] = []
+    for tag, a1, a2, b1, b2 in opcodes:
+        if tag == "equal":
+            continue
+        # 相等区间两边长度相同，前后扩展同样的行数仍然对齐
+        before = min(context, a1, b1)
+        after = min(context, source_count - a2, output_count - b2)
+        a1, b1, a2, b2 = a1 - before, b1 - before, a2 + after, b2 + after
+        if ranges and a1 <= ranges[-1][1]:
+            ranges[-1][1], ranges[-1][3] = max(ranges[-1][1], a2), max(ranges[-1][3], b2)
+        else:
+            ranges.append([a1, a2, b1, b2])
+    return [tuple(r) for r in ranges]
+
+
+def plan_reannotation(source_lines: List[str], output_lines: List[str], code_type: str,
+                      context: int = 3, min_reuse: float = 0.5) -> Optional[List[Piece]]:
+    """
+    对比新源码与已有输出（去掉注释后即旧源码），规划新输出：未改动的区域沿用旧输出（含注释），
+    改动的区域连同前后 context 行代码交给模型重新注释
+
+    按代码行（去掉空白和注释后非空的行）做 diff；旧输出中每行代码连同其前面的纯注释行、空行视为一段整体沿用。
+    可沿用的代码行少于源码代码行的 min_reuse 时返回 None（改动太大，不如整体重新注释）；源码没有改动时也返回 None
+    """
+    source_keys, source_index = _code_lines(source_lines, code_type)
+    output_keys, output_index = _code_lines(output_lines, code_type)
+    if not source_keys or not output_keys:
+        return None
+    matcher = SequenceMatcher(None, source_keys, output_keys, autojunk=False)
+    opcodes = matcher.get_opcodes()
+    if all(tag == "equal" for tag, *_ in opcodes):
+        return None
+    ranges = _changed_ranges(opcodes, context, len(source_keys), len(output_keys))
+    reused = len(source_keys) - sum(a2 - a1 for a1, a2, _, _ in ranges)
+    if reused < len(source_keys) * min_reuse:
+        return None
+
+    def output_segment(b1: int, b2: int) -> List[str]:
+        # 第 b1 到 b2-1 行代码对应的旧输出（含每行代码之前的纯注释行和空行）
+        start = output_index[b1-1] + 1 if b1 > 0 else 0
+        return output_lines[start:output_index[b2-1] + 1]
+
+    def source_segment(a1: int, a2: int) -> List[str]:
+        start = source_index[a1-1] + 1 if a1 > 0 else 0
+        end = source_index[a2-1] + 1 if a2 < len(source_keys) else len(source_lines)
+        return source_lines[start:end]
+
+    pieces: List[Piece] = []
+    a, b = 0, 0
+    for a1, a2, b1, b2 in ranges:
+        if a1 > a:
+            pieces.append(Piece(True, output_segment(b, b1)))
+        if a2 > a1 or a2 == len(source_keys):
+            pieces.append(Piece(False, source_segment(a1, a2)))
+        a, b = a2, b2
+    if a < len(source_keys):
+        # 最后一段沿用时，旧输出最后一行代码之后的内容（空行、尾部注释）一并保留
+        pieces.append(Piece(True, output_segment(b, len(output_keys)) + output_lines[output_index[-1] + 1:]))
+    return [piece for piece in pieces if piece.lines]
@@ -0,0 +1,105 @@
+import hashlib
+import os
+from typing import Iterable, List, NamedTuple, Optional
+from filter_comment import filter_space_and_comment
+
+
+class ResumeRecord(NamedTuple):
+    line: int  # 已提交的源码行数（下一个分块从该行开始）
+    digest: str  # 源码前 line 行规范化（去掉空白和注释）后的哈希
+    offset: int  # 提交该分块后输出文件的字节数
+
+
+class PrefixHasher:
+    """源码前缀规范化后的增量哈希，按行追加"""
+
+    def __init__(self, code_type: str):
+        self.code_type = code_type
+        self.line = 0
+        self._hash = hashlib.sha256()
+
+    def update(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self._hash.update(filter_space_and_comment(line, self.code_type).encode("utf-8", "surrogatepass"))
+            self.line += 1
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class ResumeIndex:
+    """
+    输出文件旁的断点索引（<输出文件>.resume），每提交一个分块追加一行 "源码行数 前缀哈希 输出字节数"
+
+    续跑时按记录顺序校验源码前缀，从最后一个仍然有效的分块之后继续，输出文件截断到该分块结尾
+    """
+
+    SUFFIX = ".resume"
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.path = output_path + self.SUFFIX
+
+    def load(self) -> List[ResumeRecord]:
+        """读取所有记录，忽略不完整的末行（写入过程中崩溃）"""
+        records = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 3 or not line.endswith("\n"):
+                        break
+                    records.append(ResumeRecord(int(parts[0]), parts[1], int(parts[2])))
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            pass
+        return records
+
+    @staticmethod
+    def format(record: ResumeRecord) -> str:
+        return f"{record.line} {record.digest} {record.offset}\n"
+
+    def append(self, record: ResumeRecord) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(self.format(record))
+
+    def reset(self, records: Iterable[ResumeRecord] = ()) -> None:
+        """用给定记录重写索引（为空时删除索引文件）"""
+        records = list(records)
+        if not records:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.writelines(self.format(r) for r in records)
+
+    def find_resume_point(self, lines: List[str], code_type: str) -> Optional[ResumeRecord]:
+        """
+        找到最后一个与当前源码一致、且输出文件中完整存在的分块记录
+
+        前缀哈希逐段增量计算，源码只规范化一遍；某条记录对不上时之后的记录也不可能对上，直接停止
+        """
+        records = self.load()
+        try:
+            size = os.path.getsize(self.output_path)
+        except OSError:
+            return None
+        hasher = PrefixHasher(code_type)
+        last = None
+        for record in records:
+            if record.line < hasher.line or record.line > len(lines) or record.offset > size:
+                break
+            hasher.update(lines[hasher.line:record.line])
+            if hasher.hexdigest() != record.digest:
+                break
+            last = record
+        return last
+
+    def truncate_to(self, record: Optional[ResumeRecord]) -> None:
+        """把输出文件和索引截断到 record 为止（None 表示清空）"""
+        offset = record.offset if record is not None else 0
+        if os.path.exists(self.output_path):
+            with open(self.output_path, "r+b") as f:
+                f.truncate(offset)
+        self.reset(r for r in self.load() if record is not None and r.line <= record.line and r.offset <= offset)
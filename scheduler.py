@@ -0,0 +1,46 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class ChunkScheduler:
+    """
+    全局分块调度器：所有文件的分块共用一个并发上限
+
+    每个分块在占用一个名额后才开始处理（包括调用API），
+    保证整个运行期间同时在途的请求数不超过 max_concurrency
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.running = 0  # 当前在途的分块数
+        self.finished = 0  # 已完成的分块数
+        self.batcher = None  # 开启批量模式时为 ChunkBatcher，小分块合并为一个请求
+
+    async def run(self, job: Callable[[], Awaitable[T]]) -> T:
+        """占用一个并发名额执行 job，执行完毕后释放"""
+        async with self._semaphore:
+            self.running += 1
+            try:
+                return await job()
+            finally:
+                self.running -= 1
+                self.finished += 1
+
+    @asynccontextmanager
+    async def released(self) -> AsyncIterator[None]:
+        """在 run 执行的 job 中临时让出名额（如等待批量请求的结果），结束后重新占用"""
+        self._semaphore.release()
+        self.running -= 1
+        try:
+            yield
+        finally:
+            await self._semaphore.acquire()
+            self.running += 1
+
+    def submit(self, job: Callable[[], Awaitable[T]]) -> "asyncio.Task[T]":
+        """立即创建任务并排队等待名额，返回可 await 的 Task"""
+        return asyncio.create_task(self.run(job))
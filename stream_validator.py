@@ -0,0 +1,81 @@
+from typing import List, Optional
+from check_comment import filter_space_and_comment
+from tokenizer import TokenCounter
+
+# 中止原因
+ABORT_TRUNCATED = "按当前进度估算输出将超出 max_tokens，会被截断"
+ABORT_DIVERGED = "输出的代码与源码不一致"
+ABORT_MULTIPLE_BLOCKS = "输出了多个代码块"
+
+
+class StreamValidator:
+    """
+    流式输出的逐行校验器：每收到一行完整输出就与源码比对，尽早发现注定失败的请求
+
+    - 代码块内的行去掉空白和注释后，须按顺序对应到源码行（允许跳过 lookahead 行以内的源码）
+    - 连续 max_divergence 行对应不上视为输出偏离源码
+    - 按已输出token数与已对应源码行数的比例估算总输出，超出 max_tokens 视为将被截断
+    """
+
+    TRUNCATION_MARGIN = 1.1  # 估算有误差，超出 10% 以上才中止
+
+    def __init__(self, content: str, code_type: str, max_tokens: int, count_tokens: TokenCounter,
+                 lookahead: int = 8, max_divergence: int = 8, min_progress: float = 0.2):
+        self.code_type = code_type
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.lookahead = lookahead
+        self.max_divergence = max_divergence
+        self.min_progress = min_progress
+        self.source = [n for n in (filter_space_and_comment(line, code_type) for line in content.split("\n")) if n]
+        self.index = 0  # 下一条待对应的源码行
+        self.tokens = 0  # 已输出的token数
+        self.unmatched = 0  # 连续对应不上的行数
+        self.in_block = False
+        self.closed = False
+        self.lines: List[str] = []  # 已校验通过的输出行
+        self._buffer = ""
+
+    def feed(self, delta: str) -> Optional[str]:
+        """输入一段增量内容，需要中止时返回中止原因"""
+        self.tokens += self.count_tokens(delta)
+        self._buffer += delta
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            reason = self._check_line(line)
+            if reason:
+                return reason
+        if self.in_block and not self.closed and self.source:
+            if self.index >= max(1, len(self.source) * self.min_progress):
+                projected = self.tokens * len(self.source) / self.index
+                if projected > self.max_tokens * self.TRUNCATION_MARGIN:
+                    return ABORT_TRUNCATED
+            if self.tokens >= self.max_tokens:
+                return ABORT_TRUNCATED
+        return None
+
+    def _check_line(self, line: str) -> Optional[str]:
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            if self.closed:
+                return ABORT_MULTIPLE_BLOCKS
+            if self.in_block:
+                self.closed = True
+            else:
+                self.in_block = True
+            return None
+        if not self.in_block or self.closed:
+            return None
+        normalized = filter_space_and_comment(line, self.code_type)
+        if normalized == "":
+            return None
+        window = self.source[self.index:self.index+self.lookahead]
+        if normalized in window:
+            self.index += window.index(normalized) + 1
+            self.unmatched = 0
+            self.lines.append(line)
+            return None
+        self.unmatched += 1
+        if self.unmatched >= self.max_divergence:
+            return ABORT_DIVERGED
+        return None
@@ -0,0 +1,217 @@
+import json
+import os
+import sqlite3
+import sys
+from collections.abc import MutableMapping
+from urllib.request import pathname2url
+from typing import Dict, Iterator, Optional, Set, Tuple
+from metrics import metrics
+from filter_comment import comment_style, filter_space_and_comment
+
+
+class TableStore(MutableMapping):
+    """
+    代码行 -> 注释行 的对照表，SQLite 存储，替代整体重写的 table.json
+
+    - 读取按需查询，不在启动时把整张表读入内存
+    - 写入先缓存在内存中，commit() 在一个短事务中只写入本次改动，不重写整个文件；
+      生成注释（调用API）期间不占用数据库写锁，多个进程可以共用同一个 table
+    - 使用回滚日志（不使用 WAL，网络文件系统上不可用），多台机器可以通过共享文件系统共用；提交是原子的，进程崩溃不会损坏已提交的数据
+    - 另有一张按规范化代码（去掉空白和注释）索引的表，缩进或空白不同的同一行代码也能找到已有注释；
+      已有的库在第一次按某种注释语法查询时补建一次索引
+    首次打开空库时，若存在旧的 table.json 会自动导入一次
+    read_only 为 True 时（如 --dry-run）不创建、不修改库文件：旧的 table.json 和规范化索引只载入内存，commit() 不写入
+    """
+
+    def __init__(self, db_path: str = "table.db", legacy_json: Optional[str] = "table.json", read_only: bool = False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self._pending: Dict[str, Optional[str]] = {}  # 尚未写入数据库的改动，None 表示删除
+        self._memory_styles: Set[str] = set()  # 只读时规范化索引只建在内存中的注释语法
+        if read_only:
+            self._conn = self._connect_read_only(db_path)
+        else:
+            dir_path = os.path.dirname(db_path)
+            if dir_path:
+                os.makedirs(dir_path, exist_ok=True)
+            # 其他进程持有写锁时最多等待 30 秒；旧版本创建的 WAL 库在没有其他连接时切换回回滚日志
+            self._conn = sqlite3.connect(db_path, timeout=30)
+            try:
+                self._conn.execute("PRAGMA journal_mode=DELETE")
+            except sqlite3.OperationalError:
+                pass  # 其他进程正在使用 WAL 库，下次单独打开时再切换
+            self._create_tables(self._conn)
+        self._pending_normalized: Dict[Tuple[str, str], str] = {}
+        self._indexed_styles: Set[str] = set()
+        self.fuzzy_hits = 0  # 按规范化代码复用注释的行数（所在分块因此无需调用API）
+        self.fuzzy_chunks = 0  # 因按规范化代码复用注释而无需调用API的分块数
+        if legacy_json and os.path.isfile(legacy_json) and self._get_meta("imported_json") is None:
+            self.import_json(legacy_json)
+
+    @staticmethod
+    def _create_tables(conn: sqlite3.Connection) -> None:
+        conn.execute("CREATE TABLE IF NOT EXISTS lines (line TEXT PRIMARY KEY, comment TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS normalized (style TEXT NOT NULL, code TEXT NOT NULL, "
+                     "comment TEXT NOT NULL, PRIMARY KEY (style, code))")
+        conn.commit()
+
+    def _connect_read_only(self, db_path: str) -> sqlite3.Connection:
+        """只读打开已有的库（旧版本创建、缺少规范化索引表的库同样可用）；库不存在时使用内存中的空库"""
+        if os.path.isfile(db_path):
+            conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True, timeout=30)
+            tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if {"lines", "meta"} <= tables:
+                return conn
+            conn.close()
+        conn = sqlite3.connect(":memory:")
+        self._create_tables(conn)
+        return conn
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def import_json(self, json_path: str) -> int:
+        """导入旧版 table.json（已存在的行不覆盖），返回导入的行数"""
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"导入 {json_path} 失败：{str(e)}")
+            return 0
+        if not isinstance(data, dict):
+            print(f"JSON 内容不是字典类型（实际类型：{type(data)}）")
+            return 0
+        if self.read_only:
+            # 只在内存中使用，不写入库文件（已存在的行不覆盖）
+            for k, v in data.items():
+                if str(k) not in self:
+                    self._pending[str(k)] = str(v)
+            print(f"已从 {json_path} 载入 {len(data)} 行（只读，不写入 {self.db_path}）")
+            return len(data)
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO lines (line, comment) VALUES (?, ?)",
+                ((str(k), str(v)) for k, v in data.items())
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('imported_json', ?)",
+                (os.path.abspath(json_path),)
+            )
+        print(f"已从 {json_path} 导入 {len(data)} 行到 {self.db_path}")
+        return len(data)
+
+    def __getitem__(self, line: str) -> str:
+        if line in self._pending:
+            comment = self._pending[line]
+        else:
+            row = self._conn.execute("SELECT comment FROM lines WHERE line = ?", (line,)).fetchone()
+            comment = row[0] if row is not None else None
+        if comment is None:
+            raise KeyError(line)
+        return comment
+
+    def __contains__(self, line: object) -> bool:
+        if line in self._pending:
+            return self._pending[line] is not None
+        return self._conn.execute("SELECT 1 FROM lines WHERE line = ?", (line,)).fetchone() is not None
+
+    def __setitem__(self, line: str, comment: str) -> None:
+        self._pending[line] = comment
+
+    def __delitem__(self, line: str) -> None:
+        if line not in self:
+            raise KeyError(line)
+        self._pending[line] = None
+
+    def __iter__(self) -> Iterator[str]:
+        self.commit()
+        for (line,) in self._conn.execute("SELECT line FROM lines"):
+            yield line
+
+    def __len__(self) -> int:
+        self.commit()
+        return self._conn.execute("SELECT COUNT(*) FROM lines").fetchone()[0]
+
+    def record_normalized(self, line: str, comment: str, code_type: str) -> None:
+        """按规范化代码记录注释行（注释行去掉注释后须与代码行相同，且只有一行）"""
+        code = filter_space_and_comment(line, code_type)
+        if code and "\n" not in comment and filter_space_and_comment(comment, code_type) == code:
+            self._pending_normalized[(comment_style(code_type), code)] = comment
+
+    def find_normalized(self, line: str, code_type: str) -> Optional[str]:
+        """按规范化代码查找注释行，返回记录时的原始注释行（缩进、空白可能与 line 不同）"""
+        code = filter_space_and_comment(line, code_type)
+        if not code:
+            return None
+        style = comment_style(code_type)
+        if style not in self._indexed_styles:
+            self._index_style(style, code_type)
+        comment = self._pending_normalized.get((style, code))
+        if comment is None and style not in self._memory_styles:
+            row = self._conn.execute("SELECT comment FROM normalized WHERE style = ? AND code = ?", (style, code)).fetchone()
+            comment = row[0] if row is not None else None
+        return comment
+
+    def _index_style(self, style: str, code_type: str) -> None:
+        """为已有的代码行补建该注释语法的规范化索引（每个库每种注释语法只进行一次）"""
+        self._indexed_styles.add(style)
+        if self._get_meta(f"normalized:{style}") is not None:
+            return
+        if self.read_only:
+            # 只读时索引只建在内存中（commit 不会写入）
+            self._memory_styles.add(style)
+            for line, comment in self._conn.execute("SELECT line, comment FROM lines").fetchall():
+                if line not in self._pending:
+                    self.record_normalized(line, comment, code_type)
+            for line, comment in self._pending.items():
+                if comment is not None:
+                    self.record_normalized(line, comment, code_type)
+            return
+        self.commit()
+        count = 0
+        with self._conn:
+            for line, comment in self._conn.execute("SELECT line, comment FROM lines").fetchall():
+                code = filter_space_and_comment(line, code_type)
+                if code and "\n" not in comment and filter_space_and_comment(comment, code_type) == code:
+                    self._conn.execute("INSERT OR IGNORE INTO normalized (style, code, comment) VALUES (?, ?, ?)",
+                                       (style, code, comment))
+                    count += 1
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, '1')", (f"normalized:{style}",))
+        if count:
+            print(f"已为 {self.db_path} 中的 {count} 行建立规范化索引（{style}）")
+
+    def commit(self) -> bool:
+        """提交自上次提交以来的改动，成功返回 True（失败时改动保留在内存中，下次提交时重试）"""
+        if self.read_only or (not self._pending and not self._pending_normalized):
+            return True
+        try:
+            with metrics.span("table_save"):
+                with self._conn:
+                    self._conn.executemany("INSERT OR REPLACE INTO lines (line, comment) VALUES (?, ?)",
+                                           ((line, comment) for line, comment in self._pending.items() if comment is not None))
+                    self._conn.executemany("DELETE FROM lines WHERE line = ?",
+                                           ((line,) for line, comment in self._pending.items() if comment is None))
+                    self._conn.executemany("INSERT OR REPLACE INTO normalized (style, code, comment) VALUES (?, ?, ?)",
+                                           ((style, code, comment) for (style, code), comment in self._pending_normalized.items()))
+            self._pending = {}
+            self._pending_normalized = {}
+            return True
+        except sqlite3.Error as e:
+            print(f"保存 table 失败：{str(e)}")
+            return False
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+
+# 手动导入旧版 table.json：python table_store.py table.json table.db
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("用法：python table_store.py <table.json> <table.db>")
+        sys.exit(1)
+    store = TableStore(sys.argv[2], legacy_json=None)
+    store.import_json(sys.argv[1])
+    store.close()
@@ -0,0 +1,109 @@
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class UsageTotals:
+    """一组调用的次数、token 数和费用"""
+
+    def __init__(self):
+        self.calls = 0
+        self.failed_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated_calls = 0  # 响应中没有 usage、按字符估算的调用次数
+        self.cost = 0.0
+
+    def add(self, prompt_tokens: int, completion_tokens: int, cost: float, success: bool, estimated: bool) -> None:
+        self.calls += 1
+        self.failed_calls += 0 if success else 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.estimated_calls += 1 if estimated else 0
+        self.cost += cost
+
+    def to_dict(self) -> Dict:
+        return {"calls": self.calls, "failed_calls": self.failed_calls,
+                "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "estimated_calls": self.estimated_calls, "cost": round(self.cost, 6)}
+
+
+class TokenUsage:
+    """
+    按文件和按第几次尝试汇总每次 API 调用的 token 用量与费用
+
+    用量取自响应中的 usage；没有 usage 时（部分接口的流式输出、被中止的流）按 token_counter 估算并标记为估算值。
+    价格为每千 token 的价格，0 表示不计费用
+    """
+
+    def __init__(self, prompt_price: float = 0.0, completion_price: float = 0.0):
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+        self._lock = threading.Lock()
+        self.total = UsageTotals()
+        self.by_file: Dict[str, UsageTotals] = {}
+        self.by_attempt: Dict[int, UsageTotals] = {}
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.prompt_price + completion_tokens * self.completion_price) / 1000
+
+    def record_result(self, file_path: str, attempt: int, result: Dict, prompt: str,
+                      token_counter=None) -> None:
+        """
+        记录 call_llm_api 的一次返回结果
+
+        没有拿到响应（网络错误、4xx/5xx）的调用只计次数；成功或被中止但响应中没有 usage 时，
+        用 token_counter 按提示词和已收到的内容估算
+        """
+        self.record_shared([(file_path, 1)], attempt, result, prompt, token_counter)
+
+    def record_shared(self, shares: List[Tuple[str, float]], attempt: int, result: Dict, prompt: str,
+                      token_counter=None) -> None:
+        """记录一次由多个文件共享的调用（批量请求），用量按 shares 中的权重分摊到各文件"""
+        usage = (result.get("response") or {}).get("usage") or {}
+        success = bool(result.get("success"))
+        estimated = False
+        if usage:
+            prompt_tokens, completion_tokens = int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+        elif token_counter is not None and (success or result.get("abort_reason")):
+            prompt_tokens, completion_tokens = token_counter(prompt), token_counter(result.get("generated_content") or "")
+            estimated = True
+        else:
+            prompt_tokens, completion_tokens = 0, 0
+        cost = self.cost(prompt_tokens, completion_tokens)
+        total_weight = sum(weight for _, weight in shares) or 1
+        with self._lock:
+            # 总计和按尝试次数的汇总只计一次调用，按文件的汇总按权重分摊
+            for totals in (self.total, self.by_attempt.setdefault(attempt, UsageTotals())):
+                totals.add(prompt_tokens, completion_tokens, cost, success, estimated)
+            for file_path, weight in shares:
+                ratio = weight / total_weight
+                self.by_file.setdefault(file_path, UsageTotals()).add(
+                    round(prompt_tokens * ratio), round(completion_tokens * ratio), cost * ratio, success, estimated)
+
+    def summary(self, top_files: Optional[int] = None) -> Dict:
+        """汇总结果；top_files 指定时只列出 token 用量最多的若干个文件"""
+        with self._lock:
+            files = sorted(self.by_file.items(), key=lambda item: -(item[1].prompt_tokens + item[1].completion_tokens))
+            if top_files is not None:
+                files = files[:top_files]
+            return {
+                "total": self.total.to_dict(),
+                "by_attempt": {str(attempt): totals.to_dict() for attempt, totals in sorted(self.by_attempt.items())},
+                "by_file": {path: totals.to_dict() for path, totals in files},
+            }
+
+    def dump(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+
+    def format_total(self) -> str:
+        """一行文字的汇总，用于运行结束时打印"""
+        total = self.total.to_dict()
+        retries = sum(totals.calls for attempt, totals in self.by_attempt.items() if attempt > 1)
+        text = (f"API 调用 {total['calls']} 次（其中重试 {retries} 次、失败 {total['failed_calls']} 次），"
+                f"输入 {total['prompt_tokens']} token，输出 {total['completion_tokens']} token")
+        if self.prompt_price or self.completion_price:
+            text += f"，费用约 {total['cost']:.4f}"
+        return text
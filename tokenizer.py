@@ -0,0 +1,34 @@
+from typing import Callable
+
+TokenCounter = Callable[[str], int]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    不依赖任何分词器的token数估算
+    ASCII 字符（代码）约 3 个字符一个token，非 ASCII 字符（中文等）按每个字符一个token计
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii + 2) // 3 + non_ascii
+
+
+def get_token_counter(spec: str = "heuristic") -> TokenCounter:
+    """
+    根据配置获取token计数函数
+
+    参数:
+        spec: "heuristic"（默认，按字符估算）或 "tiktoken[:编码名]"（需安装 tiktoken，默认 cl100k_base）
+
+    返回:
+        接收字符串、返回token数的函数；所需分词器不可用时退回字符估算
+    """
+    if spec.startswith("tiktoken"):
+        encoding_name = spec.partition(":")[2] or "cl100k_base"
+        try:
+            import tiktoken  # 可选依赖：pip install tiktoken
+            encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            print(f"无法加载 tiktoken 分词器（{encoding_name}）：{str(e)}，改用字符估算")
+            return estimate_tokens
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens
@@ -0,0 +1,219 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, TypeVar
+from manifest import Manifest
+
+T = TypeVar("T")
+
+
+class WorkUnit(NamedTuple):
+    file_id: int
+    index: int  # 分块在文件中的序号
+    file_path: str
+    content: str  # 分块代码
+
+
+class UnitResult(NamedTuple):
+    start: int  # 分块在源码中的起始行
+    end: int
+    content: str
+    result: Optional[str]  # 生成结果，生成失败或多次租约过期时为 None
+    success: bool
+
+
+class FileJob(NamedTuple):
+    file_id: int
+    file_path: str
+    output_path: str
+    code_type: str
+    content: List[str]
+    units: List[UnitResult]
+
+
+class WorkQueue:
+    """
+    多个工作进程（可以在不同机器上，共享同一文件系统）共用的 (文件, 分块) 工作队列（SQLite）
+
+    - 工作进程领取分块时获得一段时间的租约，处理期间定期续约（心跳）；进程退出或卡住导致租约过期后，分块重新回到队列，
+      同一分块租约过期达到 max_attempts 次后不再重试，按生成失败处理（写入原文）
+    - 提交结果时校验租约仍属于自己，结果和剩余分块计数在同一个事务中更新
+    - 一个文件的分块全部完成后，由领取到该文件的工作进程一次性写出输出文件（同样有租约），
+      输出文件只由一个进程原子替换，不会出现多个进程追加写同一个文件
+    所有修改都在 BEGIN IMMEDIATE 事务中进行；没有使用 WAL（网络文件系统上不可用），数据库锁由 SQLite 的文件锁保证
+    工作进程在事件循环中通过 run 调用各方法：等待其他进程释放写锁（最长 60 秒）时不阻塞进行中的请求和续约
+    """
+
+    def __init__(self, db_path: str = "work_queue.db", lease_seconds: float = 120, max_attempts: int = 3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        dir_path = os.path.dirname(db_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        # 事务由 _transaction 显式控制；其他进程持有写锁时最多等待 60 秒
+        # 连接只在队列自己的单线程执行器中（或事件循环之外）使用，同一时刻只有一个线程访问
+        self._conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        with self._transaction():
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, "
+                "output_path TEXT NOT NULL, code_type TEXT NOT NULL, source_hash TEXT NOT NULL, content TEXT NOT NULL, "
+                "status TEXT NOT NULL, remaining INTEGER NOT NULL, worker TEXT, lease_until REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS units (file_id INTEGER NOT NULL, idx INTEGER NOT NULL, "
+                "start INTEGER NOT NULL, end INTEGER NOT NULL, content TEXT NOT NULL, status TEXT NOT NULL, "
+                "worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, success INTEGER, "
+                "PRIMARY KEY (file_id, idx))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS units_status ON units (status, file_id, idx)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_status ON files (status, remaining)")
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """在队列的单线程执行器中执行 func(*args)（本队列的方法），不阻塞事件循环"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="work_queue")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """写事务：开始时即获取写锁，避免多个进程读到同一条待领取记录"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def enqueue(self, file_path: str, output_path: str, content: List[str], code_type: str,
+                spans: List[Tuple[int, int]]) -> bool:
+        """
+        把文件按 spans 切成分块加入队列，返回是否加入
+        规范化内容相同的文件已在队列中（未完成，或已完成且输出文件仍在）时不重复加入；内容有变化或上次失败时替换旧记录
+        """
+        file_path, output_path = os.path.abspath(file_path), os.path.abspath(output_path)
+        source_hash = Manifest.source_hash(content, code_type)
+        with self._transaction() as conn:
+            row = conn.execute("SELECT id, source_hash, status FROM files WHERE path = ?", (file_path,)).fetchone()
+            if row is not None:
+                file_id, old_hash, status = row
+                if old_hash == source_hash and status != "failed" and (status != "done" or os.path.isfile(output_path)):
+                    return False
+                conn.execute("DELETE FROM units WHERE file_id = ?", (file_id,))
+                conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+            file_id = conn.execute(
+                "INSERT INTO files (path, output_path, code_type, source_hash, content, status, remaining) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                (file_path, output_path, code_type, source_hash, "\n".join(content), len(spans))
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO units (file_id, idx, start, end, content, status) VALUES (?, ?, ?, ?, ?, 'pending')",
+                ((file_id, index, start, end, "".join(line + "\n" for line in content[start:end]))
+                 for index, (start, end) in enumerate(spans))
+            )
+        return True
+
+    def claim(self, worker: str) -> Optional[WorkUnit]:
+        """领取一个待处理（或租约已过期）的分块，按文件顺序领取，使文件尽早完成"""
+        now = time.time()
+        with self._transaction() as conn:
+            # 多次租约过期的分块不再重试，按生成失败完成
+            for file_id, index in conn.execute(
+                    "SELECT file_id, idx FROM units WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                    (now, self.max_attempts)).fetchall():
+                self._finish_unit(conn, file_id, index, None, False)
+            row = conn.execute(
+                "SELECT u.file_id, u.idx, f.path, u.content FROM units u JOIN files f ON f.id = u.file_id "
+                "WHERE u.status = 'pending' OR (u.status = 'leased' AND u.lease_until < ?) "
+                "ORDER BY u.file_id, u.idx LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE units SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE file_id = ? AND idx = ?", (worker, now + self.lease_seconds, row[0], row[1])
+            )
+        return WorkUnit(*row)
+
+    def renew(self, unit: WorkUnit, worker: str) -> bool:
+        """续约，返回租约是否仍属于 worker"""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE units SET lease_until = ? WHERE file_id = ? AND idx = ? AND status = 'leased' AND worker = ?",
+                (time.time() + self.lease_seconds, unit.file_id, unit.index, worker)
+            ).rowcount == 1
+
+    def complete(self, unit: WorkUnit, worker: str, result: Optional[str], success: bool) -> bool:
+        """提交分块结果；租约已过期并被其他进程领取时丢弃结果，返回 False"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status, worker FROM units WHERE file_id = ? AND idx = ?",
+                               (unit.file_id, unit.index)).fetchone()
+            if row is None or row != ("leased", worker):
+                return False
+            self._finish_unit(conn, unit.file_id, unit.index, result, success)
+        return True
+
+    @staticmethod
+    def _finish_unit(conn: sqlite3.Connection, file_id: int, index: int, result: Optional[str], success: bool) -> None:
+        conn.execute("UPDATE units SET status = 'done', worker = NULL, lease_until = NULL, result = ?, success = ? "
+                     "WHERE file_id = ? AND idx = ?", (result, int(success), file_id, index))
+        conn.execute("UPDATE files SET remaining = remaining - 1 WHERE id = ?", (file_id,))
+
+    def claim_file(self, worker: str) -> Optional[FileJob]:
+        """领取一个分块已全部完成、等待写出的文件（或写出时租约过期的文件），返回文件内容和各分块结果"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, path, output_path, code_type, content FROM files "
+                "WHERE (status = 'pending' AND remaining = 0) OR (status = 'assembling' AND lease_until < ?) LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE files SET status = 'assembling', worker = ?, lease_until = ? WHERE id = ?",
+                         (worker, now + self.lease_seconds, row[0]))
+            units = [UnitResult(start, end, content, result, bool(success)) for start, end, content, result, success in conn.execute(
+                "SELECT start, end, content, result, success FROM units WHERE file_id = ? ORDER BY idx", (row[0],))]
+        return FileJob(row[0], row[1], row[2], row[3], row[4].split("\n"), units)
+
+    def finish_file(self, job: FileJob, worker: str, success: bool) -> bool:
+        """输出文件写出后标记文件完成，并删除已不再需要的分块和源码内容"""
+        with self._transaction() as conn:
+            if conn.execute("UPDATE files SET status = ?, worker = NULL, lease_until = NULL, content = '' "
+                            "WHERE id = ? AND status = 'assembling' AND worker = ?",
+                            ("done" if success else "failed", job.file_id, worker)).rowcount != 1:
+                return False
+            conn.execute("DELETE FROM units WHERE file_id = ?", (job.file_id,))
+        return True
+
+    def is_drained(self) -> bool:
+        """所有分块和文件都已完成（没有待处理、处理中或等待写出的工作）"""
+        return self._conn.execute("SELECT 1 FROM files WHERE status IN ('pending', 'assembling') LIMIT 1").fetchone() is None
+
+    def stats(self) -> Dict[str, int]:
+        """各状态的文件数和分块数"""
+        stats = {f"files_{status}": count for status, count in
+                 self._conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status")}
+        stats.update({f"units_{status}": count for status, count in
+                      self._conn.execute("SELECT status, COUNT(*) FROM units GROUP BY status")})
+        return stats
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._conn.close()